@@ -21,23 +21,113 @@ d = { 'settings': { 'audience': 'Developers',
                 'nbs_path': '.',
                 'recursive': 'False',
                 'repo': 'alto2dataset',
-                'requirements': 'datasets toolz xmltodict loguru attrs',
+                'requirements': 'datasets pyarrow>=12.0 toolz xmltodict loguru attrs',
                 'status': '2',
                 'title': 'alto2dataset',
                 'tst_flags': 'notest',
                 'user': 'davanstrien',
                 'version': '0.0.1'},
-  'syms': { 'alto2dataset.core': {},
-            'alto2dataset.europena': { 'alto2dataset.europena.NewspaperPage': 'https://davanstrien.github.io/alto2dataset/europena.html#newspaperpage',
+  'syms': { 'alto2dataset.benchmark': { 'alto2dataset.benchmark.BenchmarkResult': 'https://davanstrien.github.io/alto2dataset/benchmark.html#benchmarkresult',
+                                        'alto2dataset.benchmark.batching_efficiency': 'https://davanstrien.github.io/alto2dataset/benchmark.html#batching_efficiency',
+                                        'alto2dataset.benchmark.compare_to_baseline': 'https://davanstrien.github.io/alto2dataset/benchmark.html#compare_to_baseline',
+                                        'alto2dataset.benchmark.make_alto_page': 'https://davanstrien.github.io/alto2dataset/benchmark.html#make_alto_page',
+                                        'alto2dataset.benchmark.make_corpus': 'https://davanstrien.github.io/alto2dataset/benchmark.html#make_corpus',
+                                        'alto2dataset.benchmark.make_edm': 'https://davanstrien.github.io/alto2dataset/benchmark.html#make_edm',
+                                        'alto2dataset.benchmark.run_benchmarks': 'https://davanstrien.github.io/alto2dataset/benchmark.html#run_benchmarks',
+                                        'alto2dataset.benchmark.save_baseline': 'https://davanstrien.github.io/alto2dataset/benchmark.html#save_baseline',
+                                        'alto2dataset.benchmark.startup_times': 'https://davanstrien.github.io/alto2dataset/benchmark.html#startup_times',
+                                        'alto2dataset.benchmark.vocabularies': 'https://davanstrien.github.io/alto2dataset/benchmark.html#vocabularies'},
+            'alto2dataset.core': {},
+            'alto2dataset.europena': { 'alto2dataset.europena.AltoBackend': 'https://davanstrien.github.io/alto2dataset/europena.html#altobackend',
+                                       'alto2dataset.europena.HashIndex': 'https://davanstrien.github.io/alto2dataset/europena.html#hashindex',
+                                       'alto2dataset.europena.HashIndex.add': 'https://davanstrien.github.io/alto2dataset/europena.html#hashindex.add',
+                                       'alto2dataset.europena.HashIndex.close': 'https://davanstrien.github.io/alto2dataset/europena.html#hashindex.close',
+                                       'alto2dataset.europena.HashIndex.get': 'https://davanstrien.github.io/alto2dataset/europena.html#hashindex.get',
+                                       'alto2dataset.europena.Manifest': 'https://davanstrien.github.io/alto2dataset/europena.html#manifest',
+                                       'alto2dataset.europena.Manifest.clean_stale': 'https://davanstrien.github.io/alto2dataset/europena.html#manifest.clean_stale',
+                                       'alto2dataset.europena.Manifest.commit': 'https://davanstrien.github.io/alto2dataset/europena.html#manifest.commit',
+                                       'alto2dataset.europena.Manifest.is_done': 'https://davanstrien.github.io/alto2dataset/europena.html#manifest.is_done',
+                                       'alto2dataset.europena.Manifest.remove_uncommitted': 'https://davanstrien.github.io/alto2dataset/europena.html#manifest.remove_uncommitted',
+                                       'alto2dataset.europena.NewspaperPage': 'https://davanstrien.github.io/alto2dataset/europena.html#newspaperpage',
                                        'alto2dataset.europena.NewspaperPageAlto': 'https://davanstrien.github.io/alto2dataset/europena.html#newspaperpagealto',
                                        'alto2dataset.europena.NewspaperPageMetadata': 'https://davanstrien.github.io/alto2dataset/europena.html#newspaperpagemetadata',
+                                       'alto2dataset.europena.OcrQuality': 'https://davanstrien.github.io/alto2dataset/europena.html#ocrquality',
+                                       'alto2dataset.europena.PageColumns': 'https://davanstrien.github.io/alto2dataset/europena.html#pagecolumns',
+                                       'alto2dataset.europena.PageColumns.append': 'https://davanstrien.github.io/alto2dataset/europena.html#pagecolumns.append',
+                                       'alto2dataset.europena.PageColumns.schema': 'https://davanstrien.github.io/alto2dataset/europena.html#pagecolumns.schema',
+                                       'alto2dataset.europena.PageColumns.to_dataset': 'https://davanstrien.github.io/alto2dataset/europena.html#pagecolumns.to_dataset',
+                                       'alto2dataset.europena.PageColumns.to_table': 'https://davanstrien.github.io/alto2dataset/europena.html#pagecolumns.to_table',
+                                       'alto2dataset.europena.PageError': 'https://davanstrien.github.io/alto2dataset/europena.html#pageerror',
+                                       'alto2dataset.europena.PageTokens': 'https://davanstrien.github.io/alto2dataset/europena.html#pagetokens',
+                                       'alto2dataset.europena.PageTokens.add': 'https://davanstrien.github.io/alto2dataset/europena.html#pagetokens.add',
+                                       'alto2dataset.europena.PageTokens.token': 'https://davanstrien.github.io/alto2dataset/europena.html#pagetokens.token',
+                                       'alto2dataset.europena.ParquetShardWriter': 'https://davanstrien.github.io/alto2dataset/europena.html#parquetshardwriter',
+                                       'alto2dataset.europena.ParquetShardWriter.buffered_rows': 'https://davanstrien.github.io/alto2dataset/europena.html#parquetshardwriter.buffered_rows',
+                                       'alto2dataset.europena.ParquetShardWriter.close': 'https://davanstrien.github.io/alto2dataset/europena.html#parquetshardwriter.close',
+                                       'alto2dataset.europena.ParquetShardWriter.flush': 'https://davanstrien.github.io/alto2dataset/europena.html#parquetshardwriter.flush',
+                                       'alto2dataset.europena.ParquetShardWriter.write': 'https://davanstrien.github.io/alto2dataset/europena.html#parquetshardwriter.write',
+                                       'alto2dataset.europena.PipelineProfile': 'https://davanstrien.github.io/alto2dataset/europena.html#pipelineprofile',
+                                       'alto2dataset.europena.PipelineProfile.add': 'https://davanstrien.github.io/alto2dataset/europena.html#pipelineprofile.add',
+                                       'alto2dataset.europena.PipelineProfile.count': 'https://davanstrien.github.io/alto2dataset/europena.html#pipelineprofile.count',
+                                       'alto2dataset.europena.PipelineProfile.merge': 'https://davanstrien.github.io/alto2dataset/europena.html#pipelineprofile.merge',
+                                       'alto2dataset.europena.PipelineProfile.progress': 'https://davanstrien.github.io/alto2dataset/europena.html#pipelineprofile.progress',
+                                       'alto2dataset.europena.PipelineProfile.save': 'https://davanstrien.github.io/alto2dataset/europena.html#pipelineprofile.save',
+                                       'alto2dataset.europena.PipelineProfile.summary': 'https://davanstrien.github.io/alto2dataset/europena.html#pipelineprofile.summary',
+                                       'alto2dataset.europena.PipelineProfile.total': 'https://davanstrien.github.io/alto2dataset/europena.html#pipelineprofile.total',
+                                       'alto2dataset.europena.StageStats': 'https://davanstrien.github.io/alto2dataset/europena.html#stagestats',
+                                       'alto2dataset.europena.ZipMember': 'https://davanstrien.github.io/alto2dataset/europena.html#zipmember',
+                                       'alto2dataset.europena.ZipMember.name': 'https://davanstrien.github.io/alto2dataset/europena.html#zipmember.name',
+                                       'alto2dataset.europena.ZipMember.open': 'https://davanstrien.github.io/alto2dataset/europena.html#zipmember.open',
+                                       'alto2dataset.europena.alto_backends': 'https://davanstrien.github.io/alto2dataset/europena.html#alto_backends',
+                                       'alto2dataset.europena.alto_files_from_zip': 'https://davanstrien.github.io/alto2dataset/europena.html#alto_files_from_zip',
                                        'alto2dataset.europena.alto_illustrations': 'https://davanstrien.github.io/alto2dataset/europena.html#alto_illustrations',
+                                       'alto2dataset.europena.alto_iterparse': 'https://davanstrien.github.io/alto2dataset/europena.html#alto_iterparse',
+                                       'alto2dataset.europena.alto_namespaces': 'https://davanstrien.github.io/alto2dataset/europena.html#alto_namespaces',
                                        'alto2dataset.europena.alto_parse': 'https://davanstrien.github.io/alto2dataset/europena.html#alto_parse',
-                                       'alto2dataset.europena.features': 'https://davanstrien.github.io/alto2dataset/europena.html#features',
+                                       'alto2dataset.europena.build_metadata_index': 'https://davanstrien.github.io/alto2dataset/europena.html#build_metadata_index',
+                                       'alto2dataset.europena.close_zips': 'https://davanstrien.github.io/alto2dataset/europena.html#close_zips',
+                                       'alto2dataset.europena.dom_max_bytes': 'https://davanstrien.github.io/alto2dataset/europena.html#dom_max_bytes',
+                                       'alto2dataset.europena.get_alto_backend': 'https://davanstrien.github.io/alto2dataset/europena.html#get_alto_backend',
                                        'alto2dataset.europena.get_alto_text': 'https://davanstrien.github.io/alto2dataset/europena.html#get_alto_text',
                                        'alto2dataset.europena.get_metadata_for_page': 'https://davanstrien.github.io/alto2dataset/europena.html#get_metadata_for_page',
                                        'alto2dataset.europena.get_metadata_from_xml': 'https://davanstrien.github.io/alto2dataset/europena.html#get_metadata_from_xml',
+                                       'alto2dataset.europena.language_decade_keys': 'https://davanstrien.github.io/alto2dataset/europena.html#language_decade_keys',
+                                       'alto2dataset.europena.low_confidence_threshold': 'https://davanstrien.github.io/alto2dataset/europena.html#low_confidence_threshold',
+                                       'alto2dataset.europena.metadata_index_fname': 'https://davanstrien.github.io/alto2dataset/europena.html#metadata_index_fname',
+                                       'alto2dataset.europena.metadata_xml_fname': 'https://davanstrien.github.io/alto2dataset/europena.html#metadata_xml_fname',
+                                       'alto2dataset.europena.ocr_histogram_bins': 'https://davanstrien.github.io/alto2dataset/europena.html#ocr_histogram_bins',
+                                       'alto2dataset.europena.ocr_quantiles': 'https://davanstrien.github.io/alto2dataset/europena.html#ocr_quantiles',
+                                       'alto2dataset.europena.output_schema': 'https://davanstrien.github.io/alto2dataset/europena.html#output_schema',
+                                       'alto2dataset.europena.page_schema': 'https://davanstrien.github.io/alto2dataset/europena.html#page_schema',
                                        'alto2dataset.europena.parse_newspaper_page': 'https://davanstrien.github.io/alto2dataset/europena.html#parse_newspaper_page',
                                        'alto2dataset.europena.process': 'https://davanstrien.github.io/alto2dataset/europena.html#process',
                                        'alto2dataset.europena.process_batch': 'https://davanstrien.github.io/alto2dataset/europena.html#process_batch',
-                                       'alto2dataset.europena.process_newspaper_page': 'https://davanstrien.github.io/alto2dataset/europena.html#process_newspaper_page'}}}
\ No newline at end of file
+                                       'alto2dataset.europena.process_batch_arrow': 'https://davanstrien.github.io/alto2dataset/europena.html#process_batch_arrow',
+                                       'alto2dataset.europena.process_iter': 'https://davanstrien.github.io/alto2dataset/europena.html#process_iter',
+                                       'alto2dataset.europena.process_iterable': 'https://davanstrien.github.io/alto2dataset/europena.html#process_iterable',
+                                       'alto2dataset.europena.process_newspaper_page': 'https://davanstrien.github.io/alto2dataset/europena.html#process_newspaper_page',
+                                       'alto2dataset.europena.process_pages': 'https://davanstrien.github.io/alto2dataset/europena.html#process_pages',
+                                       'alto2dataset.europena.process_to_parquet': 'https://davanstrien.github.io/alto2dataset/europena.html#process_to_parquet',
+                                       'alto2dataset.europena.profiling': 'https://davanstrien.github.io/alto2dataset/europena.html#profiling',
+                                       'alto2dataset.europena.size_batches': 'https://davanstrien.github.io/alto2dataset/europena.html#size_batches',
+                                       'alto2dataset.europena.source_size': 'https://davanstrien.github.io/alto2dataset/europena.html#source_size',
+                                       'alto2dataset.europena.token_output_schema': 'https://davanstrien.github.io/alto2dataset/europena.html#token_output_schema',
+                                       'alto2dataset.europena.token_schema': 'https://davanstrien.github.io/alto2dataset/europena.html#token_schema',
+                                       'alto2dataset.europena.tokens_to_arrow': 'https://davanstrien.github.io/alto2dataset/europena.html#tokens_to_arrow',
+                                       'alto2dataset.europena.worker_context': 'https://davanstrien.github.io/alto2dataset/europena.html#worker_context',
+                                       'alto2dataset.europena.worker_preload': 'https://davanstrien.github.io/alto2dataset/europena.html#worker_preload',
+                                       'alto2dataset.europena.write_partitioned_parquet': 'https://davanstrien.github.io/alto2dataset/europena.html#write_partitioned_parquet'},
+            'alto2dataset.ingest': { 'alto2dataset.ingest.StagedCollection': 'https://davanstrien.github.io/alto2dataset/ingest.html#stagedcollection',
+                                     'alto2dataset.ingest.aria2c_fetch': 'https://davanstrien.github.io/alto2dataset/ingest.html#aria2c_fetch',
+                                     'alto2dataset.ingest.default_fetch': 'https://davanstrien.github.io/alto2dataset/ingest.html#default_fetch',
+                                     'alto2dataset.ingest.europeana_alto_url': 'https://davanstrien.github.io/alto2dataset/ingest.html#europeana_alto_url',
+                                     'alto2dataset.ingest.europeana_metadata_url': 'https://davanstrien.github.io/alto2dataset/ingest.html#europeana_metadata_url',
+                                     'alto2dataset.ingest.ingest': 'https://davanstrien.github.io/alto2dataset/ingest.html#ingest',
+                                     'alto2dataset.ingest.stage_collection': 'https://davanstrien.github.io/alto2dataset/ingest.html#stage_collection',
+                                     'alto2dataset.ingest.urllib_fetch': 'https://davanstrien.github.io/alto2dataset/ingest.html#urllib_fetch'},
+            'alto2dataset.sharding': { 'alto2dataset.sharding.merge_shards': 'https://davanstrien.github.io/alto2dataset/sharding.html#merge_shards',
+                                       'alto2dataset.sharding.process_shard': 'https://davanstrien.github.io/alto2dataset/sharding.html#process_shard',
+                                       'alto2dataset.sharding.shard_dir': 'https://davanstrien.github.io/alto2dataset/sharding.html#shard_dir',
+                                       'alto2dataset.sharding.shard_files': 'https://davanstrien.github.io/alto2dataset/sharding.html#shard_files',
+                                       'alto2dataset.sharding.shard_from_env': 'https://davanstrien.github.io/alto2dataset/sharding.html#shard_from_env',
+                                       'alto2dataset.sharding.shard_of': 'https://davanstrien.github.io/alto2dataset/sharding.html#shard_of'}}}
\ No newline at end of file
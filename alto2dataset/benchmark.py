@@ -0,0 +1,356 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../02_benchmark.ipynb.
+
+# %% auto 0
+__all__ = ['vocabularies', 'make_alto_page', 'make_edm', 'make_corpus', 'BenchmarkResult', 'run_benchmarks', 'save_baseline',
+           'compare_to_baseline', 'batching_efficiency', 'startup_times']
+
+# %% ../02_benchmark.ipynb 4
+import heapq
+import json
+import multiprocessing
+import random
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from xml.sax.saxutils import escape, quoteattr
+
+from attrs import asdict, define, field
+from loguru import logger
+from toolz import partition_all
+
+from alto2dataset.europena import (
+    alto_namespaces,
+    get_metadata_from_xml,
+    metadata_xml_fname,
+    parse_newspaper_page,
+    process,
+    process_batch_arrow,
+    size_batches,
+    source_size,
+)
+
+# %% ../02_benchmark.ipynb 6
+vocabularies = {
+    "fr": "le la les de du des et en un une journal roi nation guerre paix ville province gouvernement".split(),
+    "de": "der die das und ein eine zeitung könig krieg frieden stadt regierung provinz nachrichten".split(),
+    "nl": "de het een en van krant koning oorlog vrede stad regering provincie nieuws berichten".split(),
+    "en": "the a and of to newspaper king war peace city government province news report".split(),
+}
+
+_alto_versions = {
+    2: alto_namespaces["alto-2"],
+    3: alto_namespaces["alto-3"],
+    4: alto_namespaces["alto-4"],
+}
+
+
+def make_alto_page(
+    n_lines: int = 40,
+    words_per_line: Tuple[int, int] = (3, 10),
+    lines_per_block: int = 10,
+    n_illustrations: int = 0,
+    hyphenation_rate: float = 0.05,
+    languages: Sequence[str] = ("fr",),
+    alto_version: int = 3,
+    rng: Optional[random.Random] = None,
+) -> str:
+    """Create a synthetic ALTO page"""
+    rng = rng or random.Random()
+    words = [word for language in languages for word in vocabularies[language]]
+    out = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n',
+        f'<alto xmlns="{_alto_versions[alto_version]}" xmlns:xlink="http://www.w3.org/1999/xlink">',
+        "<Description><MeasurementUnit>pixel</MeasurementUnit></Description>",
+        '<Layout><Page ID="P1" PHYSICAL_IMG_NR="1" HEIGHT="6000" WIDTH="4000"><PrintSpace>',
+    ]
+    hyphenated = None
+    for line in range(n_lines):
+        if line % lines_per_block == 0:
+            if line:
+                out.append("</TextBlock>")
+            out.append(f'<TextBlock ID="B{line // lines_per_block}">')
+        vpos = 50 + line * 30
+        out.append(f'<TextLine ID="L{line}" HPOS="50" VPOS="{vpos}" WIDTH="3900" HEIGHT="25">')
+        hpos = 50
+        strings = []
+        if hyphenated is not None:
+            # Second half of a word hyphenated at the end of the previous line
+            strings.append(
+                f'<String HPOS="{hpos}" VPOS="{vpos}" WIDTH="60" HEIGHT="25" WC="{rng.random():.2f}" '
+                f'CONTENT={quoteattr(hyphenated[len(hyphenated) // 2:])} SUBS_TYPE="HypPart2" SUBS_CONTENT={quoteattr(hyphenated)}/>'
+            )
+            hyphenated = None
+        for word in rng.choices(words, k=rng.randint(*words_per_line)):
+            hpos += 70
+            strings.append(
+                f'<String HPOS="{hpos}" VPOS="{vpos}" WIDTH="60" HEIGHT="25" WC="{rng.random():.2f}" CONTENT={quoteattr(word)}/>'
+            )
+        if line < n_lines - 1 and rng.random() < hyphenation_rate:
+            hyphenated = rng.choice(words) + rng.choice(words)
+            strings.append(
+                f'<String HPOS="{hpos + 70}" VPOS="{vpos}" WIDTH="60" HEIGHT="25" WC="{rng.random():.2f}" '
+                f'CONTENT={quoteattr(hyphenated[: len(hyphenated) // 2])} SUBS_TYPE="HypPart1" SUBS_CONTENT={quoteattr(hyphenated)}/>'
+                '<HYP CONTENT="-"/>'
+            )
+        out.append('<SP WIDTH="10"/>'.join(strings))
+        out.append("</TextLine>")
+    if n_lines:
+        out.append("</TextBlock>")
+    for illustration in range(n_illustrations):
+        out.append(
+            f'<Illustration ID="I{illustration}" HEIGHT="{rng.randint(100, 2000)}" WIDTH="{rng.randint(100, 2000)}" '
+            f'VPOS="{rng.randint(0, 4000)}" HPOS="{rng.randint(0, 2000)}"/>'
+        )
+    out.append("</PrintSpace></Page></Layout></alto>")
+    return "".join(out)
+
+# %% ../02_benchmark.ipynb 9
+def make_edm(short_id: str, title: str, date: str, languages: Sequence[str]) -> str:
+    """Create a synthetic EDM metadata file for an issue"""
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#" xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" xmlns:edm="http://www.europeana.eu/schemas/edm/" xmlns:ore="http://www.openarchives.org/ore/terms/">
+<edm:ProvidedCHO rdf:about="http://data.theeuropeanlibrary.org/BibliographicResource/{short_id}">
+<dc:title>{escape(title)} - {date}</dc:title>
+<dcterms:issued>{date}</dcterms:issued>
+<dc:language>{",".join(languages)}</dc:language>
+</edm:ProvidedCHO>
+<ore:Aggregation rdf:about="http://data.theeuropeanlibrary.org/BibliographicResource/{short_id}#aggregation">
+<edm:isShownBy rdf:resource="https://iiif.europeana.eu/image/{short_id}/full/full/0/default.jpg"/>
+</ore:Aggregation>
+</rdf:RDF>
+"""
+
+# %% ../02_benchmark.ipynb 11
+def make_corpus(
+    output_dir: Union[str, Path],
+    n_issues: int = 10,
+    pages_per_issue: int = 8,
+    collection_id: str = "9200396",
+    lines_per_page: Tuple[int, int] = (20, 200),
+    words_per_line: Tuple[int, int] = (3, 10),
+    illustration_rate: float = 0.2,
+    hyphenation_rate: float = 0.05,
+    alto_versions: Sequence[int] = (2, 3, 4),
+    languages: Sequence[Sequence[str]] = (("fr",), ("de",), ("nl",), ("fr", "de")),
+    seed: int = 0,
+) -> Tuple[List[Path], Path]:
+    """Write a synthetic corpus to `output_dir`, returns the ALTO files and the metadata directory"""
+    rng = random.Random(seed)
+    output_dir = Path(output_dir)
+    metadata_directory = output_dir / "metadata"
+    metadata_directory.mkdir(parents=True, exist_ok=True)
+    alto_files = []
+    for issue in range(n_issues):
+        short_id = f"{3000000000000 + issue}"
+        issue_languages = languages[issue % len(languages)]
+        alto_version = alto_versions[issue % len(alto_versions)]
+        issue_dir = output_dir / collection_id / f"BibliographicResource_{short_id}"
+        issue_dir.mkdir(parents=True, exist_ok=True)
+        for page in range(1, pages_per_issue + 1):
+            alto_file = issue_dir / f"{page}.xml"
+            alto_file.write_text(
+                make_alto_page(
+                    n_lines=rng.randint(*lines_per_page),
+                    words_per_line=words_per_line,
+                    n_illustrations=int(rng.random() < illustration_rate) * rng.randint(1, 3),
+                    hyphenation_rate=hyphenation_rate,
+                    languages=issue_languages,
+                    alto_version=alto_version,
+                    rng=rng,
+                ),
+                encoding="utf-8",
+            )
+            alto_files.append(alto_file)
+        date = f"{rng.randint(1700, 1950)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        Path(metadata_xml_fname(short_id, metadata_directory)).write_text(
+            make_edm(short_id, "Synthetic Gazette", date, issue_languages), encoding="utf-8"
+        )
+    return alto_files, metadata_directory
+
+# %% ../02_benchmark.ipynb 14
+@define(slots=True)
+class BenchmarkResult:
+    stage: str
+    workers: int
+    pages: int
+    bytes: int
+    seconds: float
+    peak_rss_mb: float
+    pages_per_sec: float = field(init=False)
+    mb_per_sec: float = field(init=False)
+
+    def __attrs_post_init__(self):
+        self.pages_per_sec = self.pages / self.seconds
+        self.mb_per_sec = self.bytes / 1e6 / self.seconds
+
+
+def _peak_rss_mb() -> float:
+    """Peak RSS of this process and any finished child processes"""
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+
+
+def _run_stage(
+    stage: str,
+    alto_files: List[Path],
+    metadata_directory: Path,
+    workers: int,
+    batch_size: int,
+    batch_bytes: int,
+) -> Tuple[int, int, float, float]:
+    if stage == "metadata":
+        files = sorted(Path(metadata_directory).glob("*.edm.xml"))
+    else:
+        files = alto_files
+    start = time.perf_counter()
+    if stage == "parse":
+        for alto_file in files:
+            parse_newspaper_page(alto_file)
+    elif stage == "metadata":
+        for metadata_xml in files:
+            get_metadata_from_xml(metadata_xml)
+    elif stage == "process_batch":
+        for batch in partition_all(batch_size, files):
+            process_batch_arrow(batch, metadata_directory=metadata_directory)
+    elif stage == "process":
+        process(files, batch_size=batch_size, metadata_directory=metadata_directory, max_workers=workers)
+    elif stage == "process_bytes":
+        process(
+            files,
+            batch_size=batch_size,
+            metadata_directory=metadata_directory,
+            max_workers=workers,
+            batch_bytes=batch_bytes,
+        )
+    else:
+        raise ValueError(f"Unknown stage '{stage}'")
+    seconds = time.perf_counter() - start
+    return len(files), sum(f.stat().st_size for f in files), seconds, _peak_rss_mb()
+
+
+def run_benchmarks(
+    alto_files: List[Path],
+    metadata_directory: Union[str, Path],
+    stages: Sequence[str] = ("parse", "metadata", "process_batch", "process", "process_bytes"),
+    workers: Sequence[int] = (1, 2, 4),
+    batch_size: int = 32,
+    batch_bytes: int = 2_000_000,
+) -> List[BenchmarkResult]:
+    """Benchmark each of `stages`, `process` and `process_bytes` are run once for each number of `workers`"""
+    results = []
+    for stage in stages:
+        for n_workers in workers if stage in ("process", "process_bytes") else (1,):
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                pages, n_bytes, seconds, peak_rss_mb = executor.submit(
+                    _run_stage, stage, list(alto_files), Path(metadata_directory), n_workers, batch_size, batch_bytes
+                ).result()
+            result = BenchmarkResult(stage, n_workers, pages, n_bytes, seconds, peak_rss_mb)
+            logger.info(
+                f"{stage:<14} workers={n_workers:<3} {result.pages_per_sec:9.1f} pages/s "
+                f"{result.mb_per_sec:7.2f} MB/s peak RSS {peak_rss_mb:7.1f} MB"
+            )
+            results.append(result)
+    return results
+
+# %% ../02_benchmark.ipynb 16
+def save_baseline(results: List[BenchmarkResult], path: Union[str, Path]):
+    with open(path, "w") as f:
+        json.dump([asdict(result) for result in results], f, indent=2)
+
+
+def compare_to_baseline(
+    results: List[BenchmarkResult], path: Union[str, Path], tolerance: float = 0.2
+) -> List[Tuple[str, int, float]]:
+    """Compare `results` to the baseline in `path`, returns `(stage, workers, ratio)` for any regressions"""
+    with open(path, "r") as f:
+        baseline = {(r["stage"], r["workers"]): r for r in json.load(f)}
+    regressions = []
+    for result in results:
+        previous = baseline.get((result.stage, result.workers))
+        if previous is None:
+            continue
+        ratio = result.pages_per_sec / previous["pages_per_sec"]
+        logger.info(f"{result.stage:<14} workers={result.workers:<3} {ratio:6.2f}x baseline")
+        if ratio < 1 - tolerance:
+            regressions.append((result.stage, result.workers, ratio))
+    return regressions
+
+# %% ../02_benchmark.ipynb 19
+def _makespan(batches: Iterable[List], sizes: Dict, workers: int) -> int:
+    """How long `batches` take on `workers`, each taking the next batch when it becomes free"""
+    finish = [0] * workers
+    for batch in batches:
+        heapq.heappush(finish, heapq.heappop(finish) + sum(sizes[f] for f in batch))
+    return max(finish)
+
+
+def batching_efficiency(
+    alto_files: List[Path],
+    workers: Sequence[int] = (4, 8, 16),
+    batch_size: int = 32,
+    batch_bytes: int = 2_000_000,
+) -> Dict[Tuple[str, int], float]:
+    """Estimated fraction of the ideal run time achieved batching by `batch_size` pages or `batch_bytes`"""
+    sizes = {f: source_size(f) for f in alto_files}
+    ideal_work = sum(sizes.values())
+    efficiency = {}
+    for n_workers in workers:
+        batchings = {
+            "pages": partition_all(batch_size, alto_files),
+            "bytes": size_batches(alto_files, batch_bytes, batch_size, n_workers),
+        }
+        for name, batches in batchings.items():
+            efficiency[(name, n_workers)] = ideal_work / n_workers / _makespan(batches, sizes, n_workers)
+        logger.info(
+            f"workers={n_workers:<3} by pages {efficiency[('pages', n_workers)]:.2f} "
+            f"by bytes {efficiency[('bytes', n_workers)]:.2f}"
+        )
+    return efficiency
+
+# %% ../02_benchmark.ipynb 23
+_import_script = """import sys, time
+start = time.perf_counter()
+__import__(sys.argv[1])
+print(time.perf_counter() - start)"""
+
+_pool_script = """import sys, time
+from concurrent.futures import ProcessPoolExecutor
+from alto2dataset.europena import process_batch_arrow, worker_context
+
+workers = int(sys.argv[2])
+start = time.perf_counter()
+with ProcessPoolExecutor(max_workers=workers, mp_context=worker_context(sys.argv[1])) as executor:
+    list(executor.map(process_batch_arrow, [[]] * workers))
+print(time.perf_counter() - start)"""
+
+
+def _best_of(repeat: int, *args: str) -> float:
+    return min(
+        float(subprocess.run([sys.executable, "-c", *args], capture_output=True, text=True, check=True).stdout)
+        for _ in range(repeat)
+    )
+
+
+def startup_times(
+    start_methods: Sequence[str] = ("fork", "forkserver", "spawn"),
+    workers: int = 2,
+    repeat: int = 3,
+) -> Dict[str, float]:
+    """Seconds to import the pipeline and `datasets` and to start `workers` with each of `start_methods`, best of `repeat`"""
+    times = {}
+    for module in ("alto2dataset.europena", "datasets"):
+        times[f"import {module}"] = _best_of(repeat, _import_script, module)
+    for start_method in start_methods:
+        if start_method in multiprocessing.get_all_start_methods():
+            times[start_method] = _best_of(repeat, _pool_script, start_method, str(workers))
+    for name, seconds in times.items():
+        logger.info(f"{name:<30} {seconds:6.3f}s")
+    return times
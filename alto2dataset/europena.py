@@ -1,146 +1,643 @@
 # AUTOGENERATED! DO NOT EDIT! File to edit: ../01_europena.ipynb.
 
 # %% auto 0
-__all__ = ['features', 'alto_parse', 'get_alto_text', 'alto_illustrations', 'NewspaperPageAlto', 'parse_newspaper_page',
-           'NewspaperPageMetadata', 'get_metadata_from_xml', 'get_metadata_for_page', 'NewspaperPage',
-           'process_newspaper_page', 'process_batch', 'process']
+__all__ = ['alto_namespaces', 'ocr_quantiles', 'low_confidence_threshold', 'ocr_histogram_bins', 'alto_backends', 'dom_max_bytes',
+           'metadata_index_fname', 'page_schema', 'output_schema', 'token_schema', 'token_output_schema',
+           'worker_preload', 'close_zips', 'ZipMember', 'alto_files_from_zip', 'StageStats', 'PipelineProfile',
+           'profiling', 'source_size', 'OcrQuality', 'AltoBackend', 'get_alto_backend', 'alto_parse', 'get_alto_text',
+           'alto_illustrations', 'alto_iterparse', 'PageTokens', 'NewspaperPageAlto', 'parse_newspaper_page',
+           'NewspaperPageMetadata', 'get_metadata_from_xml', 'metadata_xml_fname', 'get_metadata_for_page',
+           'build_metadata_index', 'NewspaperPage', 'process_newspaper_page', 'PageError', 'process_pages',
+           'tokens_to_arrow', 'PageColumns', 'process_batch', 'process_batch_arrow', 'ParquetShardWriter',
+           'worker_context', 'size_batches', 'process_iter', 'process', 'process_iterable', 'Manifest', 'HashIndex',
+           'process_to_parquet', 'language_decade_keys', 'write_partitioned_parquet']
 
 # %% ../01_europena.ipynb 4
+import bisect
+import hashlib
 import io
+import json
+import math
 import os
+import pickle
+import shutil
+import sqlite3
+import time
 import xml
+import zipfile
+from array import array
 import xml.etree.ElementTree as ET
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from xml.parsers import expat
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 # from dataclaises import asdict, dataclass, field
-from functools import lru_cache
-from pathlib import Path
-from statistics import mean, stdev
+from functools import lru_cache, partial
+from pathlib import Path, PurePosixPath
 from attrs import asdict
 import toolz
 import itertools
+from collections import OrderedDict, deque
 import  multiprocessing
-from typing import Any, Dict, Iterable, List, Optional, Union
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Type, Union
+import attrs
 from attrs import define, field
 
 import xmltodict
 from toolz import partition_all
-from tqdm.auto import tqdm
 
 # %% ../01_europena.ipynb 11
 from loguru import logger
 
 # %% ../01_europena.ipynb 12
-def alto_parse(alto: Union[str, Path], **kwargs):
-    """Convert ALTO xml file to element tree"""
-    try:
-        xml = ET.parse(alto, **kwargs)
-    except ET.ParseError as e:
-        logger.error(f"Parser Error in file '{alto}': {e}")
-        return None
-    # Register ALTO namespaces
-    # https://www.loc.gov/standards/alto/ | https://github.com/altoxml
-    # alto-bnf (unoffical) BnF ALTO dialect - for further info see
-    # http://bibnum.bnf.fr/alto_prod/documentation/alto_prod.html
-    namespace = {
-        "alto-1": "http://schema.ccs-gmbh.com/ALTO",
-        "alto-2": "http://www.loc.gov/standards/alto/ns-v2#",
-        "alto-3": "http://www.loc.gov/standards/alto/ns-v3#",
-        "alto-4": "http://www.loc.gov/standards/alto/ns-v4#",
-        "alto-5": "http://schema.ccs-gmbh.com/docworks/version20/alto-1-4.xsd",
-        "alto-bnf": "http://bibnum.bnf.fr/ns/alto_prod",
-    }
+# Register ALTO namespaces
+# https://www.loc.gov/standards/alto/ | https://github.com/altoxml
+# alto-bnf (unoffical) BnF ALTO dialect - for further info see
+# http://bibnum.bnf.fr/alto_prod/documentation/alto_prod.html
+alto_namespaces = {
+    "alto-1": "http://schema.ccs-gmbh.com/ALTO",
+    "alto-2": "http://www.loc.gov/standards/alto/ns-v2#",
+    "alto-3": "http://www.loc.gov/standards/alto/ns-v3#",
+    "alto-4": "http://www.loc.gov/standards/alto/ns-v4#",
+    "alto-5": "http://schema.ccs-gmbh.com/docworks/version20/alto-1-4.xsd",
+    "alto-bnf": "http://bibnum.bnf.fr/ns/alto_prod",
+}
+
+
+def _alto_xmlns(root, alto: Union[str, Path]) -> Optional[str]:
+    """Return the ALTO namespace declared on `root` or `None` if it isn't registered"""
+    name = getattr(alto, "name", alto)
     # Extract namespace from document root
-    if "http://" in str(xml.getroot().tag.split("}")[0].strip("{")):
-        xmlns = xml.getroot().tag.split("}")[0].strip("{")
+    if "http://" in str(root.tag.split("}")[0].strip("{")):
+        xmlns = root.tag.split("}")[0].strip("{")
     else:
         try:
-            ns = xml.getroot().attrib
+            ns = root.attrib
             xmlns = str(ns).split(" ")[1].strip("}").strip("'")
         except IndexError:
-            logger.warning(f"File {alto.name}: no namespace declaration found.")
+            logger.warning(f"File {name}: no namespace declaration found.")
             xmlns = "no_namespace_found"
-    if xmlns in namespace.values():
-        return alto, xml, xmlns
+    if xmlns in alto_namespaces.values():
+        return xmlns
+    logger.warning(f"File {name}: namespace {xmlns} is not registered.")
+
+# %% ../01_europena.ipynb 14
+# Zip archives open in this process, least recently used first. Keyed on the process id so
+# forked workers don't share the parent's file handle.
+_open_zips = OrderedDict()
+_max_open_zips = 16
+
+
+def _open_zip(archive: str, pid: int) -> zipfile.ZipFile:
+    key = (archive, pid)
+    if key in _open_zips:
+        _open_zips.move_to_end(key)
     else:
-        logger.warning(f"File {alto.name}: namespace {xmlns} is not registered.")
+        _open_zips[key] = zipfile.ZipFile(archive)
+        while len(_open_zips) > _max_open_zips:
+            _open_zips.popitem(last=False)[1].close()
+    return _open_zips[key]
+
+
+def close_zips():
+    """Close the zip archives this process has open, a deleted archive takes up disk space until it's closed"""
+    _zip_metadata_members.cache_clear()
+    while _open_zips:
+        _open_zips.popitem()[1].close()
+
+
+class ZipMember:
+    """A file inside a zip archive"""
+    __slots__ = ("archive", "member")
+
+    def __init__(self, archive: Union[str, Path], member: str):
+        self.archive = str(archive)
+        self.member = member
+
+    @property
+    def name(self) -> str:
+        return PurePosixPath(self.member).name
+
+    def open(self):
+        return _open_zip(self.archive, os.getpid()).open(self.member)
+
+    def __str__(self):
+        return f"{self.archive}/{self.member}"
+
+    def __repr__(self):
+        return f"ZipMember({self.archive!r}, {self.member!r})"
+
+    def __eq__(self, other):
+        return isinstance(other, ZipMember) and (self.archive, self.member) == (other.archive, other.member)
+
+    def __hash__(self):
+        return hash((self.archive, self.member))
+
+    def __getstate__(self):
+        return self.archive, self.member
+
+    def __setstate__(self, state):
+        self.archive, self.member = state
+
+
+def _open_source(source: Union[str, Path, ZipMember]):
+    """Open a file on disk or inside a zip archive for reading"""
+    if isinstance(source, ZipMember):
+        return source.open()
+    return open(source, "rb")
+
+
+def alto_files_from_zip(archive: Union[str, Path]) -> List[ZipMember]:
+    """All the ALTO files in a zip `archive`"""
+    with zipfile.ZipFile(archive) as zf:
+        return [
+            ZipMember(archive, name)
+            for name in zf.namelist()
+            if name.endswith(".xml") and "edm" not in PurePosixPath(name).name
+        ]
 
 # %% ../01_europena.ipynb 16
-def get_alto_text(xml, xmlns, join_lines=True):
-    """Extract text content from ALTO xml file"""
-    all_text = []
-    all_wc = []
-    # Find all <TextLine> elements
-    for lines in xml.iterfind(".//{%s}TextLine" % xmlns):
-        # Find all <String> elements
-        for line in lines.findall("{%s}String" % xmlns):
-            wc = line.attrib["WC"]
-            if wc is not None:
-                all_wc.append(float(wc))
-            # Check if there are no hyphenated words
-            if "SUBS_CONTENT" not in line.attrib and "SUBS_TYPE" not in line.attrib:
-                # Get value of attribute @CONTENT from all <String> elements
-                text = line.attrib.get("CONTENT")  # + ' '
-            elif "HypPart1" in line.attrib.get("SUBS_TYPE"):
-                text = line.attrib.get("SUBS_CONTENT")  # + ' '
-                if "HypPart2" in line.attrib.get("SUBS_TYPE"):
-                    pass
-            all_text.append(text)
-    if all_wc:
-        mean_ocr = mean(all_wc)
-    if len(all_wc) > 2:
-        std_ocr = stdev(all_wc)
-    else:
-        mean_ocr = None
-        std_ocr = None
-    return " ".join(all_text), mean_ocr, std_ocr
+@define(slots=True)
+class StageStats:
+    calls: int = 0
+    seconds: float = 0.0
+    bytes: int = 0
 
-# %% ../01_europena.ipynb 18
-def alto_illustrations(xml, xmlns):
-    """Extract bounding boxes of illustration from ALTO xml file"""
-    # Find all <Illustration> elements
-    bounding_boxes = []
-    for illustration in xml.iterfind(".//{%s}Illustration" % xmlns):
-        # Get @ID of <Illustration> element
-        illustration_id = illustration.attrib.get("ID")
-        # Get coordinates of <Illustration> element
-        illustration_coords = list(
-            map(
-                float,
-                (
-                    illustration.attrib.get("HEIGHT"),
-                    illustration.attrib.get("WIDTH"),
-                    illustration.attrib.get("VPOS"),
-                    illustration.attrib.get("HPOS"),
-                ),
+
+@define(slots=True)
+class PipelineProfile:
+    """Per-stage timings and per-worker counters collected while processing"""
+    stages: Dict[str, StageStats] = field(factory=dict)
+    workers: Dict[int, Dict[str, float]] = field(factory=dict)
+    # How often `process_iter` logs progress, in seconds
+    log_interval: float = 60.0
+    started: float = field(factory=time.perf_counter)
+
+    def add(self, stage: str, seconds: float, nbytes: int = 0, calls: int = 1):
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = StageStats()
+        stats.calls += calls
+        stats.seconds += seconds
+        stats.bytes += nbytes
+
+    def count(self, counter: str, n: float = 1, pid: Optional[int] = None):
+        counters = self.workers.setdefault(pid or os.getpid(), {})
+        counters[counter] = counters.get(counter, 0) + n
+
+    def merge(self, other: "PipelineProfile"):
+        for stage, stats in other.stages.items():
+            self.add(stage, stats.seconds, stats.bytes, stats.calls)
+        for pid, counters in other.workers.items():
+            for counter, n in counters.items():
+                self.count(counter, n, pid)
+
+    def total(self, counter: str) -> float:
+        return sum(counters.get(counter, 0) for counters in self.workers.values())
+
+    def progress(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        slowest = max(self.stages, key=lambda stage: self.stages[stage].seconds, default=None)
+        return {
+            "pages/s": round(self.total("pages") / elapsed, 1) if elapsed else 0.0,
+            "errors": int(self.total("errors")),
+            "slowest": slowest,
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        stage_seconds = sum(stats.seconds for stats in self.stages.values())
+        return {
+            "elapsed_seconds": elapsed,
+            "pages": int(self.total("pages")),
+            "errors": int(self.total("errors")),
+            "pages_per_sec": self.total("pages") / elapsed if elapsed else 0.0,
+            "stages": {
+                stage: {
+                    **asdict(stats),
+                    "mean_ms": 1000 * stats.seconds / stats.calls,
+                    "share": stats.seconds / stage_seconds if stage_seconds else 0.0,
+                }
+                for stage, stats in sorted(self.stages.items(), key=lambda s: -s[1].seconds)
+            },
+            "workers": {str(pid): counters for pid, counters in self.workers.items()},
+        }
+
+    def save(self, path: Union[str, Path]):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+_profile = None
+
+
+@contextmanager
+def profiling(profile: Optional[PipelineProfile] = None) -> Iterator[PipelineProfile]:
+    """Collect timings into `profile` (a new `PipelineProfile` by default) inside this block"""
+    global _profile
+    previous, _profile = _profile, profile or PipelineProfile()
+    try:
+        yield _profile
+    finally:
+        _profile = previous
+
+
+def source_size(source: Union[str, Path, ZipMember]) -> int:
+    """Uncompressed size of `source` in bytes, 0 if it can't be read"""
+    try:
+        if isinstance(source, ZipMember):
+            return _open_zip(source.archive, os.getpid()).getinfo(source.member).file_size
+        return os.stat(source).st_size
+    except (OSError, KeyError):
+        return 0
+
+
+class _timed:
+    """Record the time spent in a block as `stage` if profiling is enabled
+
+    The size of `source` or `nbytes` set inside the block are recorded as the bytes processed."""
+    __slots__ = ("stage", "source", "nbytes", "start")
+
+    def __init__(self, stage: str, source: Optional[Union[str, Path, ZipMember]] = None):
+        self.stage, self.source, self.nbytes, self.start = stage, source, 0, None
+
+    def __enter__(self):
+        if _profile is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None and _profile is not None:
+            nbytes = source_size(self.source) if self.source is not None else self.nbytes
+            _profile.add(self.stage, time.perf_counter() - self.start, nbytes)
+
+# %% ../01_europena.ipynb 19
+# Word confidence quantiles, the threshold below which a word counts as low confidence
+# and the number of equal width bins between 0 and 1 in the confidence histogram
+ocr_quantiles = (0.1, 0.25, 0.5, 0.75, 0.9)
+low_confidence_threshold = 0.5
+ocr_histogram_bins = 10
+
+
+@define(slots=True)
+class OcrQuality:
+    quantiles: Optional[List[float]]
+    low_confidence_fraction: Optional[float]
+    histogram: List[int]
+
+
+def _quantile(wc: List[float], q: float) -> float:
+    """Quantile `q` of the sorted scores `wc`, interpolating linearly between the closest two"""
+    position = q * (len(wc) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(wc) - 1)
+    return wc[lower] + (wc[upper] - wc[lower]) * (position - lower)
+
+
+def _wc_stats(all_wc: Iterable[float]) -> Tuple[Optional[float], Optional[float], OcrQuality]:
+    """Mean, standard deviation and `OcrQuality` of word confidence scores
+
+    The mean and quantiles are `None` for pages without any words and the standard deviation
+    for pages with fewer than two. Scores below 0 or above 1 are counted in the first or last
+    bin of the histogram, so it always counts every word."""
+    wc = sorted(all_wc)
+    n = len(wc)
+    # Number of scores below each inner bin edge
+    below = [bisect.bisect_left(wc, i / ocr_histogram_bins) for i in range(1, ocr_histogram_bins)]
+    histogram = [end - start for start, end in zip([0] + below, below + [n])]
+    if not n:
+        return None, None, OcrQuality(None, None, histogram)
+    mean_ocr = sum(wc) / n
+    std_ocr = math.sqrt(sum([(score - mean_ocr) ** 2 for score in wc]) / (n - 1)) if n > 1 else None
+    quality = OcrQuality(
+        [_quantile(wc, q) for q in ocr_quantiles],
+        bisect.bisect_left(wc, low_confidence_threshold) / n,
+        histogram,
+    )
+    return mean_ocr, std_ocr, quality
+
+
+@define(slots=True)
+class _AltoPageText:
+    """Collects the text, word confidence and illustrations of a page as elements are read"""
+    text: List[Optional[str]] = field(factory=list)
+    wc: array = field(factory=lambda: array("d"))
+    bounding_boxes: List[List[float]] = field(factory=list)
+    tokens: Optional["PageTokens"] = None
+    _last_text: Optional[str] = None
+
+    def add_string(self, attrib):
+        self.wc.append(float(attrib["WC"]))
+        # Check if there are no hyphenated words
+        if "SUBS_CONTENT" not in attrib and "SUBS_TYPE" not in attrib:
+            # Get value of attribute @CONTENT from all <String> elements
+            self._last_text = attrib.get("CONTENT")
+        elif "HypPart1" in attrib.get("SUBS_TYPE"):
+            self._last_text = attrib.get("SUBS_CONTENT")
+        self.text.append(self._last_text)
+        if self.tokens is not None:
+            self.tokens.add(self._last_text, attrib)
+
+    def add_illustration(self, attrib):
+        self.bounding_boxes.append(
+            list(
+                map(
+                    float,
+                    (
+                        attrib.get("HEIGHT"),
+                        attrib.get("WIDTH"),
+                        attrib.get("VPOS"),
+                        attrib.get("HPOS"),
+                    ),
+                )
             )
         )
-        bounding_boxes.append(illustration_coords)
-    return bounding_boxes
 
-# %% ../01_europena.ipynb 26
+    def result(self):
+        mean_ocr, std_ocr, quality = _wc_stats(self.wc)
+        if self.tokens is not None:
+            return " ".join(self.text), mean_ocr, std_ocr, self.bounding_boxes, quality, self.tokens
+        return " ".join(self.text), mean_ocr, std_ocr, self.bounding_boxes, quality
+
+# %% ../01_europena.ipynb 20
+def _etree_extract(alto, iterparse: Callable, tokens: bool = False):
+    """Single pass extraction using an `ElementTree` style `iterparse`"""
+    page = _AltoPageText(tokens=PageTokens() if tokens else None)
+    context = iterparse(alto, events=("start", "end"))
+    # The namespace is taken from the first start event i.e. the document root
+    _, root = next(context)
+    xmlns = _alto_xmlns(root, alto)
+    if xmlns is None:
+        return None
+    text_line = "{%s}TextLine" % xmlns
+    string = "{%s}String" % xmlns
+    illustration = "{%s}Illustration" % xmlns
+    for event, elem in context:
+        if event == "start":
+            continue
+        tag = elem.tag
+        if tag == text_line:
+            for line in elem.iterfind(string):
+                page.add_string(line.attrib)
+            elem.clear()
+        elif tag == illustration:
+            page.add_illustration(elem.attrib)
+            elem.clear()
+        elif tag != string:
+            # <String> elements are read when their <TextLine> closes
+            elem.clear()
+    return page.result()
+
+
+def _tree_strings(root, xmlns: str, page: _AltoPageText):
+    """Add the `String`s of each `TextLine` in the tree under `root` to `page`"""
+    string = "{%s}String" % xmlns
+    for line in root.iter("{%s}TextLine" % xmlns):
+        for elem in line.iterfind(string):
+            page.add_string(elem.attrib)
+
+
+def _tree_illustrations(root, xmlns: str, page: _AltoPageText):
+    for elem in root.iter("{%s}Illustration" % xmlns):
+        page.add_illustration(elem.attrib)
+
+
+def _tree_extract(root, xmlns: str, page: _AltoPageText):
+    """Add the strings and illustrations in the tree under `root` to `page`"""
+    _tree_strings(root, xmlns, page)
+    _tree_illustrations(root, xmlns, page)
+
+
+def _dom_extract(alto, parse: Callable, tokens: bool = False):
+    """Extraction from the whole tree, parsed with an `ElementTree` style `parse`"""
+    root = parse(alto).getroot()
+    xmlns = _alto_xmlns(root, alto)
+    if xmlns is None:
+        return None
+    page = _AltoPageText(tokens=PageTokens() if tokens else None)
+    _tree_extract(root, xmlns, page)
+    return page.result()
+
+
+class _UnregisteredNamespace(Exception):
+    pass
+
+
+def _clark(name: str) -> str:
+    """expat reports namespaced names as `namespace}name`, convert these to `{namespace}name`"""
+    return "{" + name if "}" in name else name
+
+
+def _expat_extract(alto, tokens: bool = False):
+    """Single pass extraction using `expat` callbacks without building any elements"""
+    page = _AltoPageText(tokens=PageTokens() if tokens else None)
+    depth = 0
+    line_depth = None
+    text_line = string = illustration = None
+
+    def start(name, attrib):
+        nonlocal depth, line_depth, text_line, string, illustration
+        depth += 1
+        if depth == 1:
+            root = ET.Element(_clark(name), {_clark(k): v for k, v in attrib.items()})
+            xmlns = _alto_xmlns(root, alto)
+            if xmlns is None:
+                raise _UnregisteredNamespace()
+            text_line, string, illustration = (
+                f"{xmlns}}}{tag}" for tag in ("TextLine", "String", "Illustration")
+            )
+        elif name == string:
+            # Only <String> elements which are direct children of a <TextLine>
+            if line_depth == depth - 1:
+                page.add_string(attrib)
+        elif name == text_line:
+            line_depth = depth
+        elif name == illustration:
+            page.add_illustration(attrib)
+
+    def end(name):
+        nonlocal depth, line_depth
+        if line_depth == depth:
+            line_depth = None
+        depth -= 1
+
+    parser = expat.ParserCreate(namespace_separator="}")
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    try:
+        if isinstance(alto, (str, Path)):
+            with open(alto, "rb") as f:
+                parser.ParseFile(f)
+        else:
+            parser.ParseFile(alto)
+    except _UnregisteredNamespace:
+        return None
+    return page.result()
+
+# %% ../01_europena.ipynb 21
+@define(slots=True, frozen=True)
+class AltoBackend:
+    name: str
+    parse: Callable
+    extract: Callable
+    errors: Tuple[Type[Exception], ...]
+
+
+alto_backends = {
+    "expat": AltoBackend(
+        "expat", ET.parse, _expat_extract, (ET.ParseError, expat.ExpatError)
+    ),
+    "etree": AltoBackend(
+        "etree", ET.parse, partial(_etree_extract, iterparse=ET.iterparse), (ET.ParseError,)
+    ),
+}
+try:
+    from lxml import etree as lxml_etree
+
+    alto_backends["lxml"] = AltoBackend(
+        "lxml",
+        lxml_etree.parse,
+        partial(_etree_extract, iterparse=lxml_etree.iterparse),
+        (lxml_etree.XMLSyntaxError,),
+    )
+except ImportError:
+    pass
+
+# The order backends are picked in when none is asked for. This isn't a ranking by speed, which
+# depends on the page: expat was fastest on our test pages but etree beat it on some multi MB pages.
+# expat comes first as it never creates elements, so memory stays flat on the large pages which are
+# streamed (see `dom_max_bytes`), and lxml last as it's an optional extra dependency.
+# `run_benchmarks` with `$ALTO2DATASET_BACKEND` set compares them on a given collection.
+_backend_preference = ("expat", "etree", "lxml")
+
+
+def get_alto_backend(name: Optional[str] = None) -> AltoBackend:
+    """Get a parser backend by name, defaults to `$ALTO2DATASET_BACKEND` or the first available in `_backend_preference`"""
+    name = name or os.environ.get("ALTO2DATASET_BACKEND")
+    if name is None:
+        return next(alto_backends[b] for b in _backend_preference if b in alto_backends)
+    try:
+        return alto_backends[name]
+    except KeyError:
+        raise ValueError(
+            f"Unknown backend '{name}', available backends are: {', '.join(alto_backends)}"
+        ) from None
+
+# %% ../01_europena.ipynb 23
+def alto_parse(alto: Union[str, Path, ZipMember], backend: Optional[str] = None, **kwargs):
+    """Convert ALTO xml file to element tree"""
+    backend = get_alto_backend(backend)
+    try:
+        with _open_source(alto) as f:
+            xml = backend.parse(f, **kwargs)
+    except backend.errors as e:
+        logger.error(f"Parser Error in file '{alto}': {e}")
+        return None
+    xmlns = _alto_xmlns(xml.getroot(), alto)
+    if xmlns is not None:
+        return alto, xml, xmlns
+
+# %% ../01_europena.ipynb 27
+def get_alto_text(xml, xmlns, join_lines=True):
+    """Extract text content and the mean and standard deviation of the word confidence from a tree returned by `alto_parse`"""
+    page = _AltoPageText()
+    _tree_strings(xml, xmlns, page)
+    text, mean_ocr, std_ocr, _, _ = page.result()
+    return text, mean_ocr, std_ocr
+
+# %% ../01_europena.ipynb 29
+def alto_illustrations(xml, xmlns):
+    """Extract bounding boxes of illustrations from a tree returned by `alto_parse`"""
+    page = _AltoPageText()
+    _tree_illustrations(xml, xmlns, page)
+    return page.bounding_boxes
+
+# %% ../01_europena.ipynb 37
+# Pages up to this many bytes of XML are parsed into a tree and larger pages are streamed.
+# Building the tree is faster for typical pages, streaming keeps memory flat for large ones.
+dom_max_bytes = 64_000
+
+
+def alto_iterparse(alto: Union[str, Path, ZipMember], backend: Optional[str] = None, tokens: bool = False):
+    """Extract text, OCR confidence, illustration bounding boxes and `OcrQuality` from an ALTO xml file
+
+    Pages larger than `dom_max_bytes` are read in a single streaming pass, smaller pages are parsed into a tree.
+    If `tokens` is `True` the `PageTokens` for the page are returned as well."""
+    backend = get_alto_backend(backend)
+    if source_size(alto) > dom_max_bytes:
+        extract = backend.extract
+    else:
+        extract = partial(_dom_extract, parse=backend.parse)
+    try:
+        with _open_source(alto) as f:
+            return extract(f, tokens=tokens)
+    except backend.errors as e:
+        logger.error(f"Parser Error in file '{alto}': {e}")
+        return None
+
+# %% ../01_europena.ipynb 44
+@define(slots=True)
+class PageTokens:
+    """Offsets into the page text, positions and confidence of each `String` on a page"""
+    offsets: array = field(factory=lambda: array("i", [0]))
+    hpos: array = field(factory=lambda: array("f"))
+    vpos: array = field(factory=lambda: array("f"))
+    width: array = field(factory=lambda: array("f"))
+    height: array = field(factory=lambda: array("f"))
+    wc: array = field(factory=lambda: array("f"))
+
+    def add(self, text: Optional[str], attrib):
+        # Missing coordinates are stored as NaN rather than failing the page
+        self.offsets.append(self.offsets[-1] + len(text or "") + 1)
+        self.hpos.append(float(attrib.get("HPOS", "nan")))
+        self.vpos.append(float(attrib.get("VPOS", "nan")))
+        self.width.append(float(attrib.get("WIDTH", "nan")))
+        self.height.append(float(attrib.get("HEIGHT", "nan")))
+        self.wc.append(float(attrib["WC"]))
+
+    def __len__(self):
+        return len(self.wc)
+
+    def token(self, text: str, i: int) -> str:
+        return text[self.offsets[i] : self.offsets[i + 1] - 1]
+
+# %% ../01_europena.ipynb 47
+def _item_id(fname: Union[str, Path, ZipMember]) -> str:
+    return "/".join(Path(str(fname)).parts[-3:-1])
+
+
+def _page_id(fname: Union[str, Path, ZipMember]) -> str:
+    """The `id` of the page processed from `fname`"""
+    name = fname.name if isinstance(fname, (Path, ZipMember)) else Path(fname).name
+    return f"https://www.europeana.eu/item/{_item_id(fname)}/${name.strip('.xml')}"
+
+
 @define(slots=True)
 class NewspaperPageAlto:
-    fname: Union[str, Path]
+    fname: Union[str, Path, ZipMember]
     text: Optional[str]
     mean_ocr: Optional[float]
     std_ocr: Optional[float]
     bounding_boxes: List[Union[float, None]]
+    ocr_quality: Optional[OcrQuality] = None
+    tokens: Optional[PageTokens] = None
     item_id: str = field(init=False)
     def _get_id(self):
-        return "/".join(Path(self.fname).parts[-3:-1])
+        return _item_id(self.fname)
 
     def __attrs_post_init__(self):
         self.item_id = self._get_id()
 
+# %% ../01_europena.ipynb 48
+def parse_newspaper_page(
+    xml_fname: Union[str, Path, ZipMember], backend: Optional[str] = None, tokens: bool = False
+):
+    with _timed("alto_parse", source=xml_fname):
+        parsed = alto_iterparse(xml_fname, backend=backend, tokens=tokens)
+    if parsed is None:
+        raise ValueError(f"Couldn't parse ALTO file '{xml_fname}'")
+    return NewspaperPageAlto(xml_fname, *parsed)
 
-# %% ../01_europena.ipynb 27
-def parse_newspaper_page(xml_fname: Union[str, Path]):
-    fname, xml, ns = alto_parse(xml_fname)
-    text, wc, std_ocr = get_alto_text(xml, ns)
-    bounding_boxes = alto_illustrations(xml, ns)
-    return NewspaperPageAlto(xml_fname, text, wc, std_ocr, bounding_boxes)
-
-# %% ../01_europena.ipynb 33
+# %% ../01_europena.ipynb 54
 @define(slots=True)
 class NewspaperPageMetadata:
     metadata_xml_fname: Union[str, Path]
@@ -159,10 +656,10 @@ class NewspaperPageMetadata:
         self.title = self.title.split("-")[0].strip(" ")
         self.metadata_xml_fname = str(self.metadata_xml_fname)
 
-# %% ../01_europena.ipynb 34
-def get_metadata_from_xml(xml_file: Union[Path, str]):
-    with open(xml_file, "r") as f:
-        xml: Dict = xmltodict.parse(f.read())
+# %% ../01_europena.ipynb 55
+def get_metadata_from_xml(xml_file: Union[Path, str, ZipMember]):
+    with _timed("metadata_parse", source=xml_file), _open_source(xml_file) as f:
+        xml: Dict = xmltodict.parse(f)
     metadata = xml.get("rdf:RDF")
     ProvidedCHO = metadata.get("edm:ProvidedCHO")
     if ProvidedCHO is not None:
@@ -177,21 +674,87 @@ def get_metadata_from_xml(xml_file: Union[Path, str]):
         title, data, languages, iiif_url = None, None, None, None
     return NewspaperPageMetadata(xml_file, title, data, languages, iiif_url, metadata)
 
-# %% ../01_europena.ipynb 38
+# %% ../01_europena.ipynb 59
+metadata_index_fname = "metadata_index.json"
+
+
+def metadata_xml_fname(short_id: str, metadata_directory: Optional[Union[str, Path]] = None) -> str:
+    """Path of the EDM metadata file for the issue `short_id`"""
+    return f"{metadata_directory}/http%3A%2F%2Fdata.theeuropeanlibrary.org%2FBibliographicResource%2F{short_id}.edm.xml"
+
+
+def _short_id_from_metadata_fname(fname: str) -> str:
+    return PurePosixPath(fname).name.split("%2F")[-1][: -len(".edm.xml")]
+
+
+@lru_cache(maxsize=16)
+def _zip_metadata_members(archive: str, pid: int) -> Dict[str, str]:
+    """Map issue ids to EDM files in a zip `archive` using its central directory"""
+    return {
+        _short_id_from_metadata_fname(name): name
+        for name in _open_zip(archive, pid).namelist()
+        if name.endswith(".edm.xml")
+    }
+
+
+@lru_cache(maxsize=8)
+def _load_metadata_index(metadata_directory: Optional[Union[str, Path]]) -> Optional[Dict[str, Dict]]:
+    index = Path(f"{metadata_directory}/{metadata_index_fname}")
+    if not index.exists():
+        return None
+    with open(index, "r") as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=1024)
+def _cached_metadata(short_id: str, metadata_directory: Optional[Union[str, Path]] = None):
+    """Metadata for an issue, all pages of an issue share the same EDM file so we only parse it once per worker"""
+    if str(metadata_directory).endswith(".zip"):
+        members = _zip_metadata_members(str(metadata_directory), os.getpid())
+        return get_metadata_from_xml(ZipMember(metadata_directory, members[short_id]))
+    index = _load_metadata_index(metadata_directory)
+    if index is not None and short_id in index:
+        return NewspaperPageMetadata(**index[short_id], all_metadata_dict={})
+    return get_metadata_from_xml(metadata_xml_fname(short_id, metadata_directory))
+
+
 def get_metadata_for_page(
-    page: NewspaperPageAlto, metadata_directory: Optional[str] = None
+    page: NewspaperPageAlto, metadata_directory: Optional[Union[str, Path]] = None
 ):
+    """Metadata for `page` from EDM files in `metadata_directory` or a zip archive of EDM files"""
     short_id = page.item_id.split("_")[-1]
-    metadata_xml = f"{metadata_directory}/http%3A%2F%2Fdata.theeuropeanlibrary.org%2FBibliographicResource%2F{short_id}.edm.xml"
-    return get_metadata_from_xml(metadata_xml)
+    return _cached_metadata(short_id, metadata_directory)
 
-# %% ../01_europena.ipynb 42
+# %% ../01_europena.ipynb 62
+def build_metadata_index(metadata_directory: Union[str, Path]) -> Path:
+    """Build an index of the metadata for all EDM files in `metadata_directory`"""
+    from tqdm.auto import tqdm
+
+    index = {}
+    for metadata_xml in tqdm(list(Path(metadata_directory).glob("*.edm.xml"))):
+        short_id = _short_id_from_metadata_fname(metadata_xml.name)
+        metadata = asdict(
+            get_metadata_from_xml(metadata_xml_fname(short_id, metadata_directory))
+        )
+        metadata.pop("all_metadata_dict")
+        index[short_id] = metadata
+    index_path = Path(metadata_directory) / metadata_index_fname
+    with open(index_path, "w") as f:
+        json.dump(index, f)
+    _load_metadata_index.cache_clear()
+    _cached_metadata.cache_clear()
+    return index_path
+
+# %% ../01_europena.ipynb 67
 @define(slots=True)
 class NewspaperPage:
     fname: Union[str, Path]
     text: Optional[str]
     mean_ocr: Optional[float]
     std_ocr: Optional[float]
+    ocr_quantiles: Optional[List[float]]
+    low_confidence_fraction: Optional[float]
+    ocr_histogram: List[int]
     bounding_boxes: List[Union[float, None]]
     item_id: str
     metadata_xml_fname: Union[str, Path]
@@ -216,81 +779,981 @@ class NewspaperPage:
         )
         self.id = f"{self.issue_uri}/${self.fname.name.strip('.xml')}"
 
-# %% ../01_europena.ipynb 43
+# %% ../01_europena.ipynb 68
+def _combine_page_metadata(
+    page: NewspaperPageAlto, metadata: NewspaperPageMetadata
+) -> NewspaperPage:
+    metadata = asdict(metadata)
+    metadata.pop("all_metadata_dict")
+    quality = page.ocr_quality
+    page = asdict(page, filter=lambda a, _: a.name not in ("tokens", "ocr_quality"))
+    return NewspaperPage(
+        **page,
+        **metadata,
+        ocr_quantiles=quality.quantiles,
+        low_confidence_fraction=quality.low_confidence_fraction,
+        ocr_histogram=quality.histogram,
+    )
+
+
 def process_newspaper_page(
-    xml_file: Union[str, Path], metadata_directory: Optional[str] = None
+    xml_file: Union[str, Path, ZipMember],
+    metadata_directory: Optional[Union[str, Path]] = None,
 ) -> NewspaperPage:
     page = parse_newspaper_page(xml_file)
     metadata = get_metadata_for_page(page, metadata_directory=metadata_directory)
-    metadata = asdict(metadata)
-    metadata.pop("all_metadata_dict")
-    page = asdict(page)
-    return NewspaperPage(**page, **metadata)
+    return _combine_page_metadata(page, metadata)
 
-# %% ../01_europena.ipynb 48
-from datasets import Dataset
-from datasets import Value, Sequence, Features
-
-# %% ../01_europena.ipynb 49
-features=Features({
-    'fname': Value(dtype='string', id=None),
-    'text': Value(dtype='string', id=None),
-    'mean_ocr': Value(dtype='float64', id=None),
-    'std_ocr': Value(dtype='float64', id=None),
-    'bounding_boxes': Sequence(
-        feature=Sequence(feature=Value(dtype='float64', id=None), length=-1, id=None),
-        length=-1,
-        id=None
-    ),
-    'item_id': Value(dtype='string', id=None),
-    "id": Value(dtype="string",id=None),
-    "issue_uri": Value(dtype="string", id=None),
-    'metadata_xml_fname': Value(dtype='string', id=None),
-    'title': Value(dtype='string', id=None),
-    'date': Value(dtype='string', id=None),
-    'languages': Sequence(feature=Value(dtype='string', id=None), length=-1, id=None),
-    'item_iiif_url': Value(dtype='string', id=None),
-    'multi_language': Value(dtype='bool', id=None),
-   
-})
-
-
-# %% ../01_europena.ipynb 52
-@logger.catch()
-def process_batch(xml_batch: Iterable[Union[str, Path]], metadata_directory: Optional[Union[str,Path]]=None)-> Dataset:
-    """Returns a dataset containing parsed newspaper pages."""
-    batch = [
-        asdict(process_newspaper_page(xml, metadata_directory=metadata_directory))
-        for xml in xml_batch
+# %% ../01_europena.ipynb 72
+@define(slots=True)
+class PageError:
+    path: str
+    stage: str
+    error: str
+    message: str
+
+
+def _quarantine(errors: List[PageError], quarantine_path: Union[str, Path]):
+    """Append `errors` to the quarantine report in `quarantine_path` as json lines"""
+    if errors:
+        with open(quarantine_path, "a") as f:
+            for error in errors:
+                f.write(json.dumps(asdict(error)) + "\n")
+
+
+def _report_errors(errors: List[PageError], quarantine_path: Optional[Union[str, Path]] = None):
+    """Log `errors` and add them to the quarantine report if there is one"""
+    for error in errors:
+        logger.warning(f"Skipping '{error.path}', {error.stage} failed with {error.error}: {error.message}")
+    if quarantine_path is not None:
+        _quarantine(errors, quarantine_path)
+
+
+def _collect_pages(
+    xml_batch: Iterable[Union[str, Path, ZipMember]],
+    metadata_directory: Optional[Union[str, Path]],
+    add: Callable[[NewspaperPageAlto, NewspaperPageMetadata], Any],
+    tokens: bool = False,
+) -> List[PageError]:
+    """Parse each file in `xml_batch` and pass it to `add` with its metadata, returning errors for files that failed"""
+    errors = []
+    n_pages = 0
+    for xml in xml_batch:
+        stage = "parse"
+        try:
+            page = parse_newspaper_page(xml, tokens=tokens)
+            stage = "metadata"
+            metadata = get_metadata_for_page(page, metadata_directory=metadata_directory)
+            stage = "page"
+            add(page, metadata)
+            n_pages += 1
+        except Exception as e:
+            errors.append(PageError(str(xml), stage, type(e).__name__, str(e)))
+    if _profile is not None:
+        _profile.count("pages", n_pages)
+        _profile.count("errors", len(errors))
+    return errors
+
+
+def process_pages(
+    xml_batch: Iterable[Union[str, Path, ZipMember]],
+    metadata_directory: Optional[Union[str, Path]] = None,
+) -> Tuple[List[NewspaperPage], List[PageError]]:
+    """Process each file in `xml_batch`, returning the pages that succeeded and errors for those that failed"""
+    pages = []
+    errors = _collect_pages(
+        xml_batch, metadata_directory, lambda page, metadata: pages.append(_combine_page_metadata(page, metadata))
+    )
+    return pages, errors
+
+# %% ../01_europena.ipynb 77
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# `datasets` takes around a second to import and isn't needed to parse pages, it's imported
+# where a `Dataset` is built so worker processes which only parse pages never load it
+if TYPE_CHECKING:
+    from datasets import Dataset, Features, IterableDataset
+
+# %% ../01_europena.ipynb 78
+# Arrow types of the `NewspaperPage` fields
+page_schema = pa.schema(
+    {
+        "fname": pa.string(),
+        "text": pa.string(),
+        "mean_ocr": pa.float64(),
+        "std_ocr": pa.float64(),
+        "ocr_quantiles": pa.list_(pa.float64()),
+        "low_confidence_fraction": pa.float64(),
+        "ocr_histogram": pa.list_(pa.int32()),
+        "bounding_boxes": pa.list_(pa.list_(pa.float64())),
+        "item_id": pa.string(),
+        "id": pa.string(),
+        "issue_uri": pa.string(),
+        "metadata_xml_fname": pa.string(),
+        "title": pa.string(),
+        "date": pa.string(),
+        "languages": pa.list_(pa.string()),
+        "item_iiif_url": pa.string(),
+        "multi_language": pa.bool_(),
+    }
+)
+
+# %% ../01_europena.ipynb 79
+# Columns only used while processing and the columns renamed in the final output
+_dropped_columns = ["item_id", "metadata_xml_fname", "fname"]
+_renamed_columns = {"languages": "language"}
+output_schema = pa.schema(
+    [
+        (_renamed_columns.get(f.name, f.name), page_schema.field(f.name).type)
+        for f in attrs.fields(NewspaperPage)
+        if f.name not in _dropped_columns
     ]
-    batch = {key: [i[key] for i in batch] for key in batch[0]}
-    dataset = Dataset.from_dict(batch,features=features)
-    dataset = dataset.remove_columns(["item_id","metadata_xml_fname","fname"])
-    dataset = dataset.rename_columns({"languages":"language"})
-    return dataset
+)
+# Columns added when word tokens are extracted, one list per page
+token_schema = pa.schema(
+    {
+        "token_offsets": pa.list_(pa.int32()),
+        **{f"token_{name}": pa.list_(pa.float32()) for name in ("hpos", "vpos", "width", "height", "wc")},
+    }
+)
+token_output_schema = pa.schema(list(output_schema) + list(token_schema))
+# The `datasets` features available as attributes of this module and the schema each is built from
+_feature_schemas = {
+    "features": "page_schema",
+    "output_features": "output_schema",
+    "token_features": "token_schema",
+    "token_output_features": "token_output_schema",
+}
+
+
+@lru_cache(maxsize=None)
+def _features(schema: pa.Schema) -> "Features":
+    """The `datasets` features for an arrow `schema`"""
+    from datasets import Features
+
+    return Features.from_arrow_schema(schema)
+
+
+def __getattr__(name: str) -> Any:
+    if name in _feature_schemas:
+        return _features(globals()[_feature_schemas[name]])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# %% ../01_europena.ipynb 82
+def _arrow_array(values: array, value_type: pa.DataType) -> pa.Array:
+    return pa.Array.from_buffers(value_type, len(values), [None, pa.py_buffer(values)])
+
+
+def _list_array(arrays: List[array], typecode: str, value_type: pa.DataType) -> pa.ListArray:
+    """Concatenate `arrays` into a `ListArray` without converting their values to python objects"""
+    offsets = array("i", [0])
+    values = array(typecode)
+    for a in arrays:
+        values.extend(a)
+        offsets.append(len(values))
+    return pa.ListArray.from_arrays(_arrow_array(offsets, pa.int32()), _arrow_array(values, value_type))
+
+
+def tokens_to_arrow(page_tokens: List[PageTokens]) -> Dict[str, pa.ListArray]:
+    """The `token_features` columns for a list of `PageTokens`"""
+    columns = {"token_offsets": _list_array([t.offsets for t in page_tokens], "i", pa.int32())}
+    for name in ("hpos", "vpos", "width", "height", "wc"):
+        columns[f"token_{name}"] = _list_array([getattr(t, name) for t in page_tokens], "f", pa.float32())
+    return columns
+
+
+@define(slots=True)
+class PageColumns:
+    """Column buffers for a batch of pages in the `output_features` schema
+
+    If `tokens` is `True` the pages' `PageTokens` are added as the `token_features` columns."""
+    tokens: bool = False
+    columns: Dict[str, List] = field(factory=lambda: {name: [] for name in output_schema.names})
+    # The source of each row, used for reporting errors but not included in the output
+    sources: List[Union[str, Path, ZipMember]] = field(factory=list)
+    page_tokens: List[PageTokens] = field(factory=list)
+
+    def append(self, page: NewspaperPageAlto, metadata: NewspaperPageMetadata):
+        languages = metadata.languages
+        if isinstance(languages, list):
+            languages = [lang for lang in languages if lang != "=="]
+        # Compute every value before appending so a failure can't leave the columns different lengths
+        row = {
+            "text": page.text,
+            "mean_ocr": page.mean_ocr,
+            "std_ocr": page.std_ocr,
+            "ocr_quantiles": page.ocr_quality.quantiles,
+            "low_confidence_fraction": page.ocr_quality.low_confidence_fraction,
+            "ocr_histogram": page.ocr_quality.histogram,
+            "bounding_boxes": page.bounding_boxes,
+            "title": metadata.title,
+            "date": metadata.date,
+            "language": languages,
+            "item_iiif_url": metadata.item_iiif_url,
+            "multi_language": isinstance(languages, list) and len(languages) > 1,
+            "issue_uri": f"https://www.europeana.eu/item/{page.item_id}",
+            "id": _page_id(page.fname),
+        }
+        if self.tokens and page.tokens is None:
+            raise ValueError(f"No tokens were extracted for '{page.fname}'")
+        for name, value in row.items():
+            self.columns[name].append(value)
+        self.sources.append(page.fname)
+        if self.tokens:
+            self.page_tokens.append(page.tokens)
+
+    def __len__(self):
+        return len(self.sources)
+
+    @property
+    def schema(self) -> pa.Schema:
+        return token_output_schema if self.tokens else output_schema
+
+    def to_table(self) -> pa.Table:
+        columns = {**self.columns, **tokens_to_arrow(self.page_tokens)} if self.tokens else self.columns
+        return pa.Table.from_pydict(columns, schema=self.schema)
+
+    def to_dataset(self) -> "Dataset":
+        from datasets import Dataset
+
+        return Dataset(self.to_table())
+
+# %% ../01_europena.ipynb 87
+@logger.catch()
+def process_batch(xml_batch: Iterable[Union[str, Path]], metadata_directory: Optional[Union[str,Path]]=None, tokens: bool = False)-> Optional["Dataset"]:
+    """Returns a dataset containing parsed newspaper pages, with their word tokens if `tokens` is `True`."""
+    columns = PageColumns(tokens=tokens)
+    errors = _collect_pages(xml_batch, metadata_directory, columns.append, tokens=tokens)
+    for error in errors:
+        logger.warning(f"Skipping '{error.path}', {error.stage} failed with {error.error}: {error.message}")
+    if not len(columns):
+        return None
+    with _timed("arrow"):
+        return columns.to_dataset()
+
+# %% ../01_europena.ipynb 92
+def process_batch_arrow(
+    xml_batch: Iterable[Union[str, Path]],
+    metadata_directory: Optional[Union[str, Path]] = None,
+    tokens: bool = False,
+) -> Tuple[Optional[pa.Table], List[PageError]]:
+    """Returns an arrow table containing parsed newspaper pages and errors for any pages which failed.
+
+    If `tokens` is `True` each page's word tokens are included as the `token_features` columns."""
+    columns = PageColumns(tokens=tokens)
+    errors = _collect_pages(xml_batch, metadata_directory, columns.append, tokens=tokens)
+    if not len(columns):
+        return None, errors
+    try:
+        with _timed("arrow"):
+            table = columns.to_table()
+    except Exception as e:
+        errors.extend(PageError(str(source), "arrow", type(e).__name__, str(e)) for source in columns.sources)
+        return None, errors
+    return table, errors
+
+# %% ../01_europena.ipynb 95
+@define(slots=True)
+class ParquetShardWriter:
+    output_dir: Union[str, Path]
+    # The output schema with the `datasets` features in its metadata by default
+    schema: pa.Schema = field(factory=lambda: _features(output_schema).arrow_schema)
+    row_group_size: int = 10_000
+    max_rows_per_file: int = 500_000
+    prefix: str = "shard"
+    # Called with the `keys` passed to `write` and the names of the files containing
+    # their rows once all of those files have been closed
+    on_commit: Optional[Callable] = None
+    files: List[Path] = field(init=False, factory=list)
+    _writer: Optional[pq.ParquetWriter] = field(init=False, default=None)
+    _rows_in_file: int = field(init=False, default=0)
+    _buffer: List[pa.Table] = field(init=False, factory=list)
+    _buffered_rows: int = field(init=False, default=0)
+    _next_index: int = field(init=False, default=0)
+    _rows_received: int = field(init=False, default=0)
+    _rows_closed: int = field(init=False, default=0)
+    _closed_files: List[Tuple[Path, int, int]] = field(init=False, factory=list)
+    _pending: List[Tuple[int, int, Any]] = field(init=False, factory=list)
+
+    def __attrs_post_init__(self):
+        self.output_dir = Path(self.output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        # Carry on numbering after any existing files so they aren't overwritten
+        existing = [
+            int(f.stem.rsplit("-", 1)[-1])
+            for f in self.output_dir.glob(f"{self.prefix}-*.parquet")
+        ]
+        self._next_index = max(existing, default=-1) + 1
+
+    def write(self, table: Optional[pa.Table], keys: Any = None):
+        num_rows = table.num_rows if table is not None else 0
+        if keys is not None:
+            self._pending.append((self._rows_received, self._rows_received + num_rows, keys))
+        self._rows_received += num_rows
+        if not num_rows:
+            return
+        # Start a new file rather than split the rows of one write between files, otherwise a file
+        # could be closed while some of the rows for its keys are still to be written
+        rows = self._rows_in_file + self._buffered_rows
+        if rows and rows + num_rows > self.max_rows_per_file:
+            self._flush(final=True)
+            self._close_file()
+        self._buffer.append(table)
+        self._buffered_rows += num_rows
+        if self._buffered_rows >= self.row_group_size:
+            self._flush()
+
+    @property
+    def buffered_rows(self) -> int:
+        return self._buffered_rows
+
+    def flush(self):
+        """Write out everything that is buffered, as a smaller row group if need be"""
+        self._flush(final=True)
+
+    def _flush(self, final: bool = False):
+        """Write out complete row groups, or everything that is buffered if `final`"""
+        if not self._buffered_rows:
+            return
+        table = pa.concat_tables(self._buffer)
+        while table.num_rows >= self.row_group_size or (final and table.num_rows):
+            if self._writer is None:
+                path = self.output_dir / f"{self.prefix}-{self._next_index:05d}.parquet"
+                self._next_index += 1
+                self._writer = pq.ParquetWriter(path, self.schema)
+                self.files.append(path)
+            rows = min(table.num_rows, self.row_group_size)
+            self._writer.write_table(table.slice(0, rows))
+            self._rows_in_file += rows
+            table = table.slice(rows)
+        self._buffer = [table] if table.num_rows else []
+        self._buffered_rows = table.num_rows
+
+    def _close_file(self):
+        if self._writer is not None:
+            self._writer.close()
+            start = self._rows_closed
+            self._rows_closed += self._rows_in_file
+            self._closed_files.append((self.files[-1], start, self._rows_closed))
+        self._writer, self._rows_in_file = None, 0
+        self._commit()
+
+    def _commit(self):
+        committed = [p for p in self._pending if p[1] <= self._rows_closed]
+        self._pending = [p for p in self._pending if p[1] > self._rows_closed]
+        if self.on_commit is None:
+            return
+        for start, end, keys in committed:
+            files = [path.name for path, s, e in self._closed_files if s < end and e > start]
+            self.on_commit(keys, files)
+
+    def close(self) -> List[Path]:
+        self._flush(final=True)
+        self._close_file()
+        return self.files
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# %% ../01_europena.ipynb 98
+def _profiled_batch(batch_func: Callable, xml_batch: List, **kwargs) -> Tuple[Any, PipelineProfile]:
+    """Run `batch_func` with profiling enabled, returning its result and the profile"""
+    with profiling() as profile:
+        start = time.perf_counter()
+        result = batch_func(xml_batch, **kwargs)
+        # Pickling the result is most of the cost of sending it back to the parent
+        with _timed("serialize") as timer:
+            timer.nbytes = len(pickle.dumps(result))
+        profile.count("batches")
+        profile.count("busy_seconds", time.perf_counter() - start)
+    return result, profile
+
+
+# Modules the forkserver imports once so forked workers start with them loaded
+worker_preload = ["alto2dataset.europena"]
+
+
+def worker_context(start_method: Optional[str] = None) -> multiprocessing.context.BaseContext:
+    """The multiprocessing context used to start workers, `start_method` defaults to
+    `$ALTO2DATASET_START_METHOD` or the platform's default"""
+    start_method = start_method or os.environ.get("ALTO2DATASET_START_METHOD")
+    context = multiprocessing.get_context(start_method)
+    if context.get_start_method() == "forkserver":
+        context.set_forkserver_preload(worker_preload)
+    return context
+
+
+def size_batches(
+    xml_files: Iterable[Union[str, Path, ZipMember]], batch_bytes: int, max_pages: int, workers: int
+) -> Iterator[List[Union[str, Path, ZipMember]]]:
+    """Batch `xml_files` into batches of about `batch_bytes` of XML and at most `max_pages` pages
+
+    Around `workers` batches worth of files are held back and split into smaller batches once
+    `xml_files` runs out, so the end of a run isn't spent waiting on a few workers with full batches."""
+    buffer = deque()
+    buffered = 0
+
+    def take(budget):
+        nonlocal buffered
+        batch, size = [], 0
+        # Every batch gets at least one page, however large
+        while buffer and len(batch) < max_pages and (not batch or size + buffer[0][1] <= budget):
+            xml, xml_size = buffer.popleft()
+            batch.append(xml)
+            size += xml_size
+        buffered -= size
+        return batch
+
+    for xml in xml_files:
+        xml_size = source_size(xml)
+        buffer.append((xml, xml_size))
+        buffered += xml_size
+        while buffered > (workers + 1) * batch_bytes or len(buffer) > (workers + 1) * max_pages:
+            yield take(batch_bytes)
+    tail_budget = max(buffered // (2 * workers), 1)
+    while buffer:
+        yield take(min(batch_bytes, tail_budget))
+
+
+def process_iter(
+    xml_files: Iterable[Union[str, Path]],
+    batch_size: int = 32,
+    metadata_directory: Optional[Union[str, Path]] = None,
+    max_workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    total: Optional[int] = None,
+    batch_func: Callable = process_batch,
+    return_batches: bool = False,
+    profile: Optional[PipelineProfile] = None,
+    batch_bytes: Optional[int] = None,
+    start_method: Optional[str] = None,
+) -> Iterator[Any]:
+    """Process `xml_files` in parallel, yielding the result of `batch_func` for each batch as it completes
+
+    If `batch_bytes` is given batches are made up of about this many bytes of XML, and at most `batch_size` pages,
+    rather than a fixed number of pages, with smaller batches at the end of the run.
+    If `return_batches` is `True` `(batch, result)` tuples are yielded instead.
+    If a `profile` is passed the workers' timings and counters are merged into it.
+    Workers are started with `start_method`, see `worker_context`."""
+    from tqdm.auto import tqdm
+
+    if not max_workers:
+        max_workers = multiprocessing.cpu_count()
+    # Limit the number of batches submitted to the pool at once so neither the
+    # input nor the results are held in memory ahead of the workers
+    if not max_in_flight:
+        max_in_flight = 2 * max_workers
+    if total is None and hasattr(xml_files, "__len__"):
+        total = len(xml_files)
+    total_batches = -(-total // batch_size) if total is not None and batch_bytes is None else None
+    if batch_bytes is None:
+        batches = partition_all(batch_size, xml_files)
+    else:
+        batches = size_batches(xml_files, batch_bytes, batch_size, max_workers)
+    last_logged = time.perf_counter()
+
+    def result(future):
+        nonlocal last_logged
+        batch = pending.pop(future)
+        value = future.result()
+        if profile is not None:
+            value, worker_profile = value
+            profile.merge(worker_profile)
+            pbar.set_postfix(profile.progress(), refresh=False)
+            if time.perf_counter() - last_logged >= profile.log_interval:
+                last_logged = time.perf_counter()
+                logger.info(", ".join(f"{k}: {v}" for k, v in profile.progress().items()))
+        pbar.update(1)
+        return (batch, value) if return_batches else value
+
+    def submit(batch):
+        if profile is None:
+            return executor.submit(batch_func, batch, metadata_directory=metadata_directory)
+        return executor.submit(
+            _profiled_batch, batch_func, batch, metadata_directory=metadata_directory
+        )
+
+    with tqdm(total=total_batches, unit="batch") as pbar, ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=worker_context(start_method)
+    ) as executor:
+        pending = {}
+        try:
+            for batch in batches:
+                batch = list(batch)
+                future = submit(batch)
+                pending[future] = batch
+                if len(pending) >= max_in_flight:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield result(future)
+            for future in as_completed(list(pending)):
+                yield result(future)
+        finally:
+            # Don't wait on queued work if the caller stops consuming early
+            for future in pending:
+                future.cancel()
 
 
-# %% ../01_europena.ipynb 56
 def process(
     xml_files: Iterable[Union[str, Path]],
     batch_size: int = 32,
     metadata_directory: Optional[Union[str,Path]] = None,
-    max_workers: Optional[int] = None
-):
-    xml_files_for_count, xml_files = itertools.tee(xml_files)
-    total = toolz.count(xml_files_for_count)
-    with tqdm(total=total // batch_size) as pbar:
-        if not max_workers:
-            max_workers = multiprocessing.cpu_count()
-        futures = []
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            for batch in partition_all(batch_size, xml_files):
-                batch = list(batch)
-                future = executor.submit(
-                    process_batch, batch, metadata_directory=metadata_directory
-                )
-                future.add_done_callback(lambda p: pbar.update(1))
-                futures.append(future)
-    return [future.result() for future in as_completed(futures)]
+    max_workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    total: Optional[int] = None,
+    profile_path: Optional[Union[str, Path]] = None,
+    batch_bytes: Optional[int] = None,
+    streaming: bool = False,
+    start_method: Optional[str] = None,
+    quarantine_path: Optional[Union[str, Path]] = None,
+) -> Union[List["Dataset"], "IterableDataset"]:
+    """Process `xml_files` in parallel returning a `Dataset` for each batch
+
+    If `streaming` is `True` a single `IterableDataset` is returned instead, see `process_iterable`.
+    If `profile_path` is given per-stage timings are collected and saved there as JSON.
+    Files which fail are logged and, if `quarantine_path` is given, recorded there as json lines of `PageError`s.
+    The workers only build arrow tables, which are wrapped in a `Dataset` here, so they never import `datasets`."""
+    from datasets import Dataset
+
+    if streaming:
+        return process_iterable(
+            xml_files,
+            batch_size=batch_size,
+            metadata_directory=metadata_directory,
+            max_workers=max_workers,
+            max_in_flight=max_in_flight,
+            batch_bytes=batch_bytes,
+            start_method=start_method,
+            quarantine_path=quarantine_path,
+        )
+    profile = PipelineProfile() if profile_path else None
+    datasets = []
+    for table, errors in process_iter(
+        xml_files,
+        batch_size=batch_size,
+        metadata_directory=metadata_directory,
+        max_workers=max_workers,
+        max_in_flight=max_in_flight,
+        total=total,
+        batch_func=process_batch_arrow,
+        profile=profile,
+        batch_bytes=batch_bytes,
+        start_method=start_method,
+    ):
+        _report_errors(errors, quarantine_path)
+        datasets.append(Dataset(table) if table is not None else None)
+    if profile is not None:
+        profile.save(profile_path)
+    return datasets
+
+# %% ../01_europena.ipynb 111
+def _iter_pages(
+    shards: List[Sequence[Union[str, Path, ZipMember]]],
+    quarantine_path: Optional[Union[str, Path]] = None,
+    **process_kwargs,
+) -> Iterator[Dict[str, Any]]:
+    xml_files = itertools.chain.from_iterable(shards)
+    for table, errors in process_iter(xml_files, batch_func=process_batch_arrow, **process_kwargs):
+        _report_errors(errors, quarantine_path)
+        if table is not None:
+            yield from table.to_pylist()
+
+
+def process_iterable(
+    xml_files: Iterable[Union[str, Path, ZipMember]],
+    batch_size: int = 32,
+    metadata_directory: Optional[Union[str, Path]] = None,
+    max_workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    batch_bytes: Optional[int] = None,
+    start_method: Optional[str] = None,
+    quarantine_path: Optional[Union[str, Path]] = None,
+    num_shards: int = 1,
+) -> "IterableDataset":
+    """An `IterableDataset` of the pages in `xml_files`, processed in parallel as it is iterated over
+
+    `xml_files` is split into `num_shards` shards so a `DataLoader` with several workers, or
+    `split_dataset_by_node`, can give each its own files. `datasets` pickles the shards to fingerprint
+    the dataset, so `xml_files` is read into a list first unless it is already a sequence."""
+    from datasets import IterableDataset
+
+    if not isinstance(xml_files, Sequence):
+        xml_files = list(xml_files)
+    shard_size = max(-(-len(xml_files) // num_shards), 1)
+    shards = [xml_files[start : start + shard_size] for start in range(0, len(xml_files), shard_size)]
+    return IterableDataset.from_generator(
+        partial(
+            _iter_pages,
+            batch_size=batch_size,
+            metadata_directory=metadata_directory,
+            max_workers=max_workers,
+            max_in_flight=max_in_flight,
+            batch_bytes=batch_bytes,
+            start_method=start_method,
+            quarantine_path=quarantine_path,
+        ),
+        gen_kwargs={"shards": shards or [[]]},
+        features=_features(output_schema),
+    )
+
+# %% ../01_europena.ipynb 118
+def _fingerprint(source: Union[str, Path, ZipMember]) -> Optional[Dict[str, int]]:
+    try:
+        if isinstance(source, ZipMember):
+            info = _open_zip(source.archive, os.getpid()).getinfo(source.member)
+            return {"size": info.file_size, "crc": info.CRC}
+        stat = os.stat(source)
+        return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    except (OSError, KeyError):
+        return None
+
+
+# Statuses of files which don't need processing again while they're unchanged
+_done_statuses = ("ok", "duplicate")
+
+
+@define(slots=True)
+class Manifest:
+    """Records which input files have been written to the parquet files in an output directory"""
+    path: Path = field(converter=Path)
+    files: Dict[str, Dict] = field(init=False, factory=dict)
+    shards: set = field(init=False, factory=set)
+    stale: Dict[str, set] = field(init=False, factory=dict)
+
+    def __attrs_post_init__(self):
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                for line in f:
+                    self._apply(json.loads(line))
 
+    def _apply(self, record: Dict):
+        if "path" in record:
+            self.files[record["path"]] = record
+            self.shards.update(record["shards"])
+        elif "stale" in record:
+            self.stale.setdefault(record["stale"], set()).add(record["id"])
+        elif "cleaned" in record:
+            self.stale.pop(record["cleaned"], None)
 
+    def _append(self, records: List[Dict]):
+        with open(self.path, "a") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+                self._apply(record)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def is_done(self, source: Union[str, Path, ZipMember], fingerprint: Optional[Dict]) -> bool:
+        """Whether `source` was written, or is a duplicate, and hasn't changed since. Failed files are never done."""
+        record = self.files.get(str(source))
+        return (
+            fingerprint is not None
+            and record is not None
+            and record["status"] in _done_statuses
+            and record["fingerprint"] == fingerprint
+        )
+
+    def commit(self, files: List[Tuple[Union[str, Path, ZipMember], Optional[Dict], str]], shards: List[str]):
+        """Record `files` as `(source, fingerprint, status)` written to `shards`"""
+        records = []
+        for source, fingerprint, status in files:
+            previous = self.files.get(str(source))
+            # Rows from an earlier version of this file need removing
+            if previous is not None and previous["status"] == "ok":
+                records.extend({"stale": shard, "id": _page_id(source)} for shard in previous["shards"])
+            records.append(
+                {"path": str(source), "fingerprint": fingerprint, "status": status, "shards": shards}
+            )
+        self._append(records)
+
+    def remove_uncommitted(self, output_dir: Union[str, Path], prefix: str = "shard"):
+        """Remove parquet files which were never committed, i.e. from a run which stopped part way through"""
+        for shard in Path(output_dir).glob(f"{prefix}-*.parquet"):
+            if shard.name not in self.shards:
+                logger.info(f"Removing uncommitted file '{shard}'")
+                shard.unlink()
+
+    def clean_stale(self, output_dir: Union[str, Path]):
+        """Remove rows from earlier versions of reprocessed files"""
+        import pyarrow.compute as pc
+
+        for shard, ids in list(self.stale.items()):
+            path = Path(output_dir) / shard
+            if path.exists():
+                table = pq.read_table(path)
+                table = table.filter(pc.invert(pc.is_in(table["id"], pa.array(list(ids)))))
+                tmp_path = path.with_suffix(".tmp")
+                pq.write_table(table, tmp_path)
+                os.replace(tmp_path, path)
+            self._append([{"cleaned": shard}])
+
+# %% ../01_europena.ipynb 120
+def _content_hash(source: Union[str, Path, ZipMember]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with _open_source(source) as f:
+        for chunk in iter(partial(f.read, 1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hashed_batch(batch_func: Callable, xml_batch: List, **kwargs) -> Tuple[Any, List[Optional[str]]]:
+    """Run `batch_func` on `xml_batch` and hash the content of each file, `None` for files which can't be read"""
+    digests = []
+    for source in xml_batch:
+        with _timed("hash", source):
+            try:
+                digests.append(_content_hash(source))
+            except (OSError, KeyError):
+                digests.append(None)
+    return batch_func(xml_batch, **kwargs), digests
+
+
+@define(slots=True)
+class HashIndex:
+    """A persistent index from the content hash of input files to the page they were written as"""
+    path: Path = field(converter=Path)
+    _conn: sqlite3.Connection = field(init=False, default=None)
+
+    def __attrs_post_init__(self):
+        self._conn = sqlite3.connect(str(self.path))
+        self._conn.execute("CREATE TABLE IF NOT EXISTS hashes (hash TEXT PRIMARY KEY, path TEXT, id TEXT)")
+
+    def get(self, digest: str) -> Optional[Dict[str, str]]:
+        row = self._conn.execute("SELECT path, id FROM hashes WHERE hash = ?", (digest,)).fetchone()
+        return {"path": row[0], "id": row[1]} if row is not None else None
+
+    def add(self, records: List[Tuple[str, str, str]]):
+        """Add `(hash, path, id)` records, keeping the first page written for a hash"""
+        with self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO hashes VALUES (?, ?, ?)", records)
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+# %% ../01_europena.ipynb 122
+def process_to_parquet(
+    xml_files: Iterable[Union[str, Path]],
+    output_dir: Union[str, Path],
+    batch_size: int = 32,
+    metadata_directory: Optional[Union[str, Path]] = None,
+    max_workers: Optional[int] = None,
+    max_in_flight: Optional[int] = None,
+    total: Optional[int] = None,
+    row_group_size: int = 10_000,
+    max_rows_per_file: int = 500_000,
+    quarantine_path: Optional[Union[str, Path]] = None,
+    manifest_path: Optional[Union[str, Path]] = None,
+    profile_path: Optional[Union[str, Path]] = None,
+    tokens: bool = False,
+    batch_bytes: Optional[int] = None,
+    dedup_index: Optional[Union[str, Path]] = None,
+    start_method: Optional[str] = None,
+) -> List[Path]:
+    """Process `xml_files` in parallel writing the results to parquet files in `output_dir`
+
+    Files which fail are recorded as json lines in `quarantine_path` (`output_dir/quarantine.jsonl` by default).
+    Files which have been written are recorded in `manifest_path` (`output_dir/manifest.jsonl` by default)
+    and are skipped if they haven't changed when processing into the same `output_dir` again,
+    files which failed are processed again.
+    If `profile_path` is given per-stage timings are collected and saved there as JSON.
+    If `tokens` is `True` the word tokens of each page are written as well, see `token_features`.
+    If `batch_bytes` is given batches are sized by bytes of XML rather than pages, see `process_iter`.
+    If `dedup_index` is given files with the same content as a file already written are skipped,
+    see `HashIndex`, and recorded in `output_dir/duplicates.jsonl`.
+    Workers are started with `start_method`, see `worker_context`."""
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if quarantine_path is None:
+        quarantine_path = output_dir / "quarantine.jsonl"
+    manifest = Manifest(manifest_path or output_dir / "manifest.jsonl")
+    manifest.remove_uncommitted(output_dir)
+    manifest.clean_stale(output_dir)
+    fingerprints = {}
+    skipped = 0
+    index = HashIndex(dedup_index) if dedup_index is not None else None
+    # Hashes of files written in this run which haven't been committed yet
+    hashes, pending = {}, {}
+    # Files with the same content as a pending file, they're only duplicates once it has been committed
+    held: Dict[str, List] = {}
+    duplicates = 0
+
+    def duplicate(source, fingerprint, original):
+        nonlocal duplicates
+        with open(output_dir / "duplicates.jsonl", "a") as f:
+            f.write(json.dumps({"path": str(source), "id": _page_id(source), "duplicate_of": original}) + "\n")
+        manifest.commit([(source, fingerprint, "duplicate")], [])
+        duplicates += 1
+
+    def todo(sources):
+        nonlocal skipped
+        for source in sources:
+            fingerprint = _fingerprint(source)
+            if manifest.is_done(source, fingerprint):
+                skipped += 1
+                continue
+            fingerprints[str(source)] = fingerprint
+            yield source
+
+    def is_duplicate(source, fingerprint, digest, failed):
+        """Whether a file which was processed has the same content as one written before it"""
+        if digest in pending:
+            held.setdefault(digest, []).append((source, fingerprint))
+            return True
+        original = index.get(digest)
+        if original is not None:
+            duplicate(source, fingerprint, original)
+            return True
+        if not failed:
+            hashes[str(source)] = digest
+            pending[digest] = {"path": str(source), "id": _page_id(source)}
+        return False
+
+    def on_commit(files, shards):
+        manifest.commit(files, shards)
+        if index is None:
+            return
+        records = []
+        for source, _, status in files:
+            digest = hashes.pop(str(source), None)
+            if digest is not None and status == "ok":
+                original = pending.pop(digest)
+                records.append((digest, str(source), _page_id(source)))
+                for held_source, fingerprint in held.pop(digest, []):
+                    duplicate(held_source, fingerprint, original)
+        index.add(records)
+
+    n_errors = 0
+    profile = PipelineProfile() if profile_path else None
+    with profiling(profile) if profile is not None else nullcontext(), ParquetShardWriter(
+        output_dir,
+        schema=_features(token_output_schema if tokens else output_schema).arrow_schema,
+        row_group_size=row_group_size,
+        max_rows_per_file=max_rows_per_file,
+        on_commit=on_commit,
+    ) as writer:
+        batch_func = partial(process_batch_arrow, tokens=True) if tokens else process_batch_arrow
+        # The workers hash the files they process, so hashing doesn't hold up the parent
+        if index is not None:
+            batch_func = partial(_hashed_batch, batch_func)
+        for batch, result in process_iter(
+            todo(xml_files),
+            batch_size=batch_size,
+            metadata_directory=metadata_directory,
+            max_workers=max_workers,
+            max_in_flight=max_in_flight,
+            total=total,
+            batch_func=batch_func,
+            return_batches=True,
+            profile=profile,
+            batch_bytes=batch_bytes,
+            start_method=start_method,
+        ):
+            (table, errors), digests = result if index is not None else (result, [None] * len(batch))
+            failed = {error.path for error in errors}
+            keys, dropped = [], {}
+            for source, digest in zip(batch, digests):
+                fingerprint = fingerprints.pop(str(source))
+                # A duplicate of a page which has been written isn't a failure, whether or not it could be processed
+                if digest is not None and is_duplicate(source, fingerprint, digest, str(source) in failed):
+                    dropped[str(source)] = _page_id(source)
+                else:
+                    keys.append((source, fingerprint, "failed" if str(source) in failed else "ok"))
+            errors = [error for error in errors if error.path not in dropped]
+            if errors:
+                _quarantine(errors, quarantine_path)
+                n_errors += len(errors)
+            if dropped and table is not None:
+                import pyarrow.compute as pc
+
+                table = table.filter(pc.invert(pc.is_in(table["id"], value_set=pa.array(list(dropped.values())))))
+            with _timed("parquet_write"):
+                writer.write(table, keys=keys)
+    manifest.clean_stale(output_dir)
+    if profile is not None:
+        profile.save(profile_path)
+    if index is not None:
+        index.close()
+    if skipped:
+        logger.info(f"Skipped {skipped} files which were already processed")
+    if duplicates:
+        logger.info(f"Skipped {duplicates} duplicate files, see '{output_dir / 'duplicates.jsonl'}'")
+    if n_errors:
+        logger.warning(f"{n_errors} files failed, see '{quarantine_path}'")
+    return writer.files
+
+# %% ../01_europena.ipynb 136
+def language_decade_keys(table: Union[pa.Table, pa.RecordBatch]) -> Tuple[pa.Array, pa.Array]:
+    """The language and decade partition keys for each row of `table`"""
+    import pyarrow.compute as pc
+
+    language = table["language"]
+    # Single language pages have a list with one language so joining gives us that language
+    single_language = pc.binary_join(language, "")
+    language_key = pc.if_else(
+        table["multi_language"],
+        "multi_language",
+        pc.if_else(pc.is_null(language), "no_language_found", single_language),
+    )
+    # Pages with an empty language list don't belong to any partition
+    language_key = pc.if_else(pc.equal(language_key, ""), None, language_key)
+    year = pc.list_element(pc.split_pattern(table["date"], "-"), 0)
+    decade_key = pc.binary_join_element_wise(pc.utf8_slice_codeunits(year, 0, 3), "0", "")
+    return language_key, decade_key
+
+
+def write_partitioned_parquet(
+    batches: Iterable[Union[pa.Table, pa.RecordBatch]],
+    output_dir: Union[str, Path],
+    row_group_size: int = 10_000,
+    max_buffered_rows: int = 50_000,
+) -> Dict[Tuple[str, str], List[Path]]:
+    """Write `batches` to parquet files partitioned by language and decade
+
+    Any partitions already in `output_dir` are removed first. At most `max_buffered_rows` rows are
+    held across all the partitions, the partitions holding the most are written out early as smaller row groups."""
+    for old_partition in Path(output_dir).glob("language_group=*"):
+        shutil.rmtree(old_partition)
+    writers: Dict[Tuple[str, str], ParquetShardWriter] = {}
+    skipped = 0
+    for batch in batches:
+        table = pa.Table.from_batches([batch]) if isinstance(batch, pa.RecordBatch) else batch
+        language_key, decade_key = language_decade_keys(table)
+        groups = (
+            pa.table(
+                {
+                    "language": language_key,
+                    "decade": decade_key,
+                    "row": pa.array(range(table.num_rows), pa.int64()),
+                }
+            )
+            .group_by(["language", "decade"], use_threads=False)
+            .aggregate([("row", "list")])
+        )
+        for language, decade, rows in zip(*(groups[c].to_pylist() for c in ("language", "decade", "row_list"))):
+            if language is None or decade is None:
+                skipped += len(rows)
+                continue
+            if (language, decade) not in writers:
+                writers[language, decade] = ParquetShardWriter(
+                    Path(output_dir) / f"language_group={language}" / f"decade={decade}",
+                    schema=table.schema,
+                    row_group_size=row_group_size,
+                    prefix="part",
+                )
+            writers[language, decade].write(table.take(rows))
+        buffered = sorted(writers.values(), key=lambda writer: writer.buffered_rows)
+        total = sum(writer.buffered_rows for writer in buffered)
+        while total > max_buffered_rows:
+            writer = buffered.pop()
+            total -= writer.buffered_rows
+            writer.flush()
+    if skipped:
+        logger.warning(f"{skipped} rows without a language or date weren't written")
+    return {key: writer.close() for key, writer in writers.items()}
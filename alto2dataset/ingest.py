@@ -0,0 +1,173 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../03_ingest.ipynb.
+
+# %% auto 0
+__all__ = ['europeana_alto_url', 'europeana_metadata_url', 'urllib_fetch', 'aria2c_fetch', 'default_fetch', 'StagedCollection',
+           'stage_collection', 'ingest']
+
+# %% ../03_ingest.ipynb 4
+import multiprocessing
+import os
+import shutil
+import subprocess
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Union
+
+from attrs import define
+from loguru import logger
+
+from .europena import alto_files_from_zip, close_zips, process_to_parquet
+
+# %% ../03_ingest.ipynb 6
+europeana_alto_url = "ftp://download.europeana.eu/newspapers/fulltext/alto/{id}.zip"
+europeana_metadata_url = "ftp://download.europeana.eu/newspapers/metadata/{id}.zip"
+
+
+def _part(dest: Path) -> Path:
+    return dest.with_name(dest.name + ".part")
+
+
+def urllib_fetch(url: str, dest: Union[str, Path]) -> Path:
+    dest = Path(dest)
+    with urllib.request.urlopen(url) as response, open(_part(dest), "wb") as f:
+        shutil.copyfileobj(response, f, 1 << 20)
+    return _part(dest).replace(dest)
+
+
+def aria2c_fetch(url: str, dest: Union[str, Path], connections: int = 4) -> Path:
+    dest = Path(dest)
+    subprocess.run(
+        [
+            "aria2c",
+            "-x",
+            str(connections),
+            "-s",
+            str(connections),
+            "--allow-overwrite=true",
+            "-d",
+            str(dest.parent),
+            "-o",
+            _part(dest).name,
+            url,
+        ],
+        check=True,
+    )
+    return _part(dest).replace(dest)
+
+
+def default_fetch(url: str, dest: Union[str, Path]) -> Path:
+    """Fetch with `aria2c` if it's installed, otherwise `urllib`"""
+    if shutil.which("aria2c"):
+        return aria2c_fetch(url, dest)
+    return urllib_fetch(url, dest)
+
+# %% ../03_ingest.ipynb 9
+@define(slots=True)
+class StagedCollection:
+    collection_id: str
+    directory: Path
+    alto_zip: Path
+    metadata_zip: Path
+
+
+def stage_collection(
+    collection_id: Union[str, int],
+    staging_dir: Union[str, Path],
+    alto_url: str = europeana_alto_url,
+    metadata_url: str = europeana_metadata_url,
+    fetch: Callable = default_fetch,
+) -> StagedCollection:
+    """Download the ALTO and metadata zips for `collection_id`, `{id}` in the urls is replaced by the id"""
+    collection_id = str(collection_id)
+    directory = Path(staging_dir) / collection_id
+    directory.mkdir(parents=True, exist_ok=True)
+    alto_zip = fetch(alto_url.format(id=collection_id), directory / f"{collection_id}.zip")
+    metadata_zip = fetch(metadata_url.format(id=collection_id), directory / "metadata.zip")
+    return StagedCollection(collection_id, directory, Path(alto_zip), Path(metadata_zip))
+
+
+def _staged_bytes(staging_dir: Path) -> int:
+    return sum(f.stat().st_size for f in staging_dir.rglob("*") if f.is_file())
+
+# %% ../03_ingest.ipynb 11
+def ingest(
+    collection_ids: Iterable[Union[str, int]],
+    output_dir: Union[str, Path],
+    staging_dir: Union[str, Path] = "altodata",
+    alto_url: str = europeana_alto_url,
+    metadata_url: str = europeana_metadata_url,
+    fetch: Callable = default_fetch,
+    prefetch: int = 1,
+    download_workers: int = 2,
+    max_staging_bytes: Optional[int] = None,
+    keep_staged: bool = False,
+    start_method: Optional[str] = None,
+    **process_kwargs,
+) -> Dict[str, str]:
+    """Download and process `collection_ids` into `output_dir`, downloading ahead while processing
+
+    `process_kwargs` are passed to `process_to_parquet`. Workers are started with `start_method`,
+    `$ALTO2DATASET_START_METHOD` or `forkserver` where it's available, see `worker_context`.
+    Returns the status of each collection, one of `"done"`, `"skipped"` or `"failed"`."""
+    output_dir, staging_dir = Path(output_dir), Path(staging_dir)
+    # Workers are started while the download threads are running and forking a process
+    # with threads running can deadlock, so they're forked from a fork server instead
+    start_method = start_method or os.environ.get("ALTO2DATASET_START_METHOD")
+    if start_method is None and "forkserver" in multiprocessing.get_all_start_methods():
+        start_method = "forkserver"
+    staging_dir.mkdir(parents=True, exist_ok=True)
+    statuses = {}
+    todo = []
+    for collection_id in map(str, collection_ids):
+        if (output_dir / collection_id / "_SUCCESS").exists():
+            statuses[collection_id] = "skipped"
+        else:
+            todo.append(collection_id)
+    with ThreadPoolExecutor(max_workers=download_workers) as executor:
+        staged = {}
+
+        def download_ahead(current: int):
+            for i in range(current, min(current + prefetch + 1, len(todo))):
+                if i in staged:
+                    continue
+                # Always download the collection we need next, only prefetch within the budget.
+                # The size of a download isn't known until it finishes so wait for those in progress.
+                if i > current and max_staging_bytes is not None and (
+                    not all(future.done() for future in staged.values())
+                    or _staged_bytes(staging_dir) >= max_staging_bytes
+                ):
+                    break
+                staged[i] = executor.submit(
+                    stage_collection, todo[i], staging_dir, alto_url, metadata_url, fetch
+                )
+
+        for i, collection_id in enumerate(todo):
+            download_ahead(i)
+            try:
+                collection = staged.pop(i).result()
+            except Exception as e:
+                logger.error(f"Downloading collection {collection_id} failed: {e}")
+                statuses[collection_id] = "failed"
+                shutil.rmtree(staging_dir / collection_id, ignore_errors=True)
+                continue
+            # Start downloads which were held back by the staging budget
+            download_ahead(i)
+            try:
+                process_to_parquet(
+                    alto_files_from_zip(collection.alto_zip),
+                    output_dir / collection_id,
+                    metadata_directory=collection.metadata_zip,
+                    start_method=start_method,
+                    **process_kwargs,
+                )
+                (output_dir / collection_id / "_SUCCESS").touch()
+                statuses[collection_id] = "done"
+            except Exception as e:
+                logger.error(f"Processing collection {collection_id} failed: {e}")
+                statuses[collection_id] = "failed"
+            finally:
+                if not keep_staged:
+                    close_zips()
+                    shutil.rmtree(collection.directory, ignore_errors=True)
+    return statuses
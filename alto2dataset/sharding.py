@@ -0,0 +1,181 @@
+# AUTOGENERATED! DO NOT EDIT! File to edit: ../04_sharding.ipynb.
+
+# %% auto 0
+__all__ = ['shard_of', 'shard_files', 'shard_from_env', 'shard_dir', 'process_shard', 'merge_shards']
+
+# %% ../04_sharding.ipynb 4
+import hashlib
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from loguru import logger
+
+from .europena import Manifest, ZipMember, _item_id, process_to_parquet
+
+# %% ../04_sharding.ipynb 6
+def _shard_key(source: Union[str, Path, ZipMember], by: str = "item_id") -> str:
+    if by == "item_id":
+        return _item_id(source)
+    if by == "path":
+        return str(source)
+    raise ValueError(f"Unknown shard key '{by}', expected 'item_id' or 'path'")
+
+
+def shard_of(source: Union[str, Path, ZipMember], num_shards: int, by: str = "item_id") -> int:
+    """The shard `source` belongs to out of `num_shards`"""
+    digest = hashlib.blake2b(_shard_key(source, by).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % num_shards
+
+
+def shard_files(
+    xml_files: Iterable[Union[str, Path, ZipMember]], shard_index: int, num_shards: int, by: str = "item_id"
+) -> Iterator[Union[str, Path, ZipMember]]:
+    """The files in `xml_files` belonging to shard `shard_index` of `num_shards`"""
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"shard_index must be between 0 and {num_shards - 1}, got {shard_index}")
+    return (f for f in xml_files if shard_of(f, num_shards, by) == shard_index)
+
+
+def shard_from_env() -> Optional[Tuple[int, int]]:
+    """`(shard_index, num_shards)` from `$ALTO2DATASET_SHARD`, formatted as `index/num_shards` e.g. `0/4`"""
+    value = os.environ.get("ALTO2DATASET_SHARD")
+    if not value:
+        return None
+    shard_index, num_shards = map(int, value.split("/"))
+    return shard_index, num_shards
+
+# %% ../04_sharding.ipynb 9
+_shard_dir_pattern = re.compile(r"shard-(\d+)-of-(\d+)$")
+
+
+def shard_dir(output_dir: Union[str, Path], shard_index: int, num_shards: int) -> Path:
+    return Path(output_dir) / f"shard-{shard_index:05d}-of-{num_shards:05d}"
+
+
+def process_shard(
+    xml_files: Iterable[Union[str, Path, ZipMember]],
+    output_dir: Union[str, Path],
+    shard_index: Optional[int] = None,
+    num_shards: Optional[int] = None,
+    by: str = "item_id",
+    **process_kwargs,
+) -> Path:
+    """Process the files in `xml_files` belonging to this shard with `process_to_parquet`
+
+    The shard defaults to `$ALTO2DATASET_SHARD`. `process_kwargs` are passed to `process_to_parquet`."""
+    if shard_index is None or num_shards is None:
+        from_env = shard_from_env()
+        if from_env is None:
+            raise ValueError("Pass shard_index and num_shards or set $ALTO2DATASET_SHARD")
+        shard_index, num_shards = from_env
+    directory = shard_dir(output_dir, shard_index, num_shards)
+    process_to_parquet(shard_files(xml_files, shard_index, num_shards, by), directory, **process_kwargs)
+    with open(directory / "_SUCCESS", "w") as f:
+        json.dump({"shard_index": shard_index, "num_shards": num_shards, "by": by}, f)
+    return directory
+
+# %% ../04_sharding.ipynb 11
+def _finished_shards(shards_dir: Path) -> Tuple[List[Path], List[str]]:
+    shard_dirs = sorted(d for d in shards_dir.iterdir() if d.is_dir() and _shard_dir_pattern.match(d.name))
+    if not shard_dirs:
+        return [], [f"No shard directories found in '{shards_dir}'"]
+    problems = []
+    infos = []
+    for directory in shard_dirs:
+        success = directory / "_SUCCESS"
+        if not success.exists():
+            problems.append(f"Shard '{directory.name}' hasn't finished")
+            continue
+        infos.append(json.loads(success.read_text()))
+    if len({(info["num_shards"], info["by"]) for info in infos}) > 1:
+        problems.append("Shards were partitioned with different num_shards or keys")
+    num_shards = {int(_shard_dir_pattern.match(d.name).group(2)) for d in shard_dirs}
+    if len(num_shards) > 1:
+        problems.append(f"Found shards for different numbers of shards: {sorted(num_shards)}")
+    else:
+        missing = set(range(num_shards.pop())) - {int(_shard_dir_pattern.match(d.name).group(1)) for d in shard_dirs}
+        if missing:
+            problems.append(f"Shards {sorted(missing)} are missing")
+    return shard_dirs, problems
+
+
+def _validate_shard(
+    directory: Path, seen: Dict[str, str], schema: Optional[pa.Schema]
+) -> Tuple[Manifest, List[Path], Optional[pa.Schema], List[str]]:
+    """Check a finished shard, `seen` maps the files processed by earlier shards to their shard"""
+    problems = []
+    info = json.loads((directory / "_SUCCESS").read_text())
+    manifest = Manifest(directory / "manifest.jsonl")
+    for path, record in manifest.files.items():
+        if path in seen:
+            problems.append(f"'{path}' was processed by both '{seen[path]}' and '{directory.name}'")
+        seen[path] = directory.name
+        if shard_of(path, info["num_shards"], info["by"]) != info["shard_index"]:
+            problems.append(f"'{path}' doesn't belong in '{directory.name}'")
+    files = sorted(directory.glob("shard-*.parquet"))
+    rows = 0
+    for f in files:
+        metadata = pq.ParquetFile(f)
+        rows += metadata.metadata.num_rows
+        if schema is None:
+            schema = metadata.schema_arrow
+        elif not metadata.schema_arrow.equals(schema):
+            problems.append(f"'{f}' has a different schema")
+    expected = sum(record["status"] == "ok" for record in manifest.files.values())
+    if rows != expected:
+        problems.append(f"'{directory.name}' has {rows} rows but its manifest records {expected} pages")
+    if manifest.stale:
+        problems.append(f"'{directory.name}' has stale rows which haven't been removed")
+    return manifest, files, schema, problems
+
+
+def merge_shards(
+    shards_dir: Union[str, Path], output_dir: Optional[Union[str, Path]] = None, move: bool = False
+) -> List[Path]:
+    """Validate and combine the shards in `shards_dir` into `output_dir` (`shards_dir` by default)
+
+    With `move=True` the shard directories are removed once they've been merged."""
+    shards_dir = Path(shards_dir)
+    output_dir = Path(output_dir) if output_dir is not None else shards_dir
+    shard_dirs, problems = _finished_shards(shards_dir)
+    seen, schema, shards = {}, None, []
+    for directory in shard_dirs:
+        if (directory / "_SUCCESS").exists():
+            manifest, files, schema, shard_problems = _validate_shard(directory, seen, schema)
+            problems.extend(shard_problems)
+            shards.append((directory, manifest, files))
+    if problems:
+        raise ValueError("Can't merge shards:\n" + "\n".join(problems))
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if list(output_dir.glob("shard-*.parquet")) or (output_dir / "manifest.jsonl").exists():
+        raise ValueError(f"'{output_dir}' already contains merged output")
+    copy = shutil.move if move else shutil.copy2
+    merged_files = []
+    merged_manifest = Manifest(output_dir / "manifest.jsonl")
+    for directory, manifest, files in shards:
+        renamed = {}
+        for f in files:
+            merged = output_dir / f"shard-{len(merged_files):05d}.parquet"
+            copy(str(f), str(merged))
+            renamed[f.name] = merged.name
+            merged_files.append(merged)
+        merged_manifest._append(
+            [{**record, "shards": [renamed[s] for s in record["shards"]]} for record in manifest.files.values()]
+        )
+        for report in ("quarantine.jsonl", "duplicates.jsonl"):
+            if (directory / report).exists():
+                with open(output_dir / report, "a") as f:
+                    f.write((directory / report).read_text())
+    (output_dir / "_SUCCESS").touch()
+    if move:
+        # Without their parquet files the shards would no longer match their manifests
+        for directory, _, _ in shards:
+            shutil.rmtree(directory)
+    logger.info(f"Merged {len(shards)} shards into {len(merged_files)} files in '{output_dir}'")
+    return merged_files
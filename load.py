@@ -1,110 +1,28 @@
-import subprocess
 from pathlib import Path
 
-from datasets import concatenate_datasets
-from datasets import load_dataset
 import datasets
-from toolz import concat
-from tqdm import tqdm
 
-from alto2dataset.europena import *
+from alto2dataset.europena import write_partitioned_parquet
+from alto2dataset.ingest import ingest
 
 europena_ids = [9200396, 9200357, 9200300, 9200339, 9200355, 9200356, 9200301, 9200338]
 
-all_datasets = []
-Path("altodata").mkdir(exist_ok=True)
-Path("altodata/metadata").mkdir(exist_ok=True)
-for id_ in tqdm(europena_ids):
-    print(id_)
-    if Path(f"{id_}.parquet").exists():
-        continue
-    subprocess.call(
-        [
-            "aria2c",
-            "-x",
-            "4",
-            "-j",
-            "4",
-            "-d",
-            "altodata/",
-            f"ftp://download.europeana.eu/newspapers/fulltext/alto/{id_}.zip",
-        ]
-    )
-    print("unzip....")
-    subprocess.call(["unzip", "-q", "altodata/*.zip", "-d", "altodata"])
-    [p.unlink() for p in Path("altodata").rglob("*.zip")]
-    subprocess.call(
-        [
-            "aria2c",
-            "-x",
-            "4",
-            "-j",
-            "4",
-            "-d",
-            "altodata/metadata/",
-            f"ftp://download.europeana.eu/newspapers/metadata/{id_}.zip",
-        ]
-    )
-    print("unzip....")
-    subprocess.call(
-        [
-            "unzip",
-            "-q",
-            "altodata/metadata/*.zip",
-            "-d",
-            "altodata/metadata/",
-        ]
-    )
-    [p.unlink() for p in Path("altodata/metadata").rglob("*.zip")]
-    alto_xmls = (f for f in Path("altodata").rglob("*.xml") if "edm" not in f.name)
-    datasets = process(
-        alto_xmls,
-        batch_size=8,
-        metadata_directory="altodata/metadata",
-        max_workers=4,
-    )
-    not_none_datasets = []
-    for dataset in datasets:
-        if dataset is not None:
-            not_none_datasets.append(dataset)
-        else:
-            print("None found in batch")
-    dataset = concatenate_datasets(not_none_datasets)
-    dataset.to_parquet(f"{id_}.parquet")
-    [p.unlink() for p in Path("altodata").rglob("*.xml")]
-parquet_files = Path(".").rglob("*.parquet")
+# Download the next collection while the current one is processed, finished
+# collections are skipped and interrupted ones pick up where they left off
+statuses = ingest(
+    europena_ids,
+    "parquet",
+    staging_dir="altodata",
+    batch_size=32,
+    batch_bytes=2_000_000,
+    max_workers=4,
+    # Collections overlap, skip pages already written for an earlier collection
+    dedup_index="parquet/dedup.sqlite",
+)
+print(statuses)
+parquet_files = Path("parquet").glob("*/*.parquet")
 parquet_files = [str(f) for f in parquet_files]
 ds = datasets.Dataset.from_parquet(parquet_files)
 ds.save_to_disk("all_data")
-languages = ds["language"]
-languages = (language for language in languages if language is not None)
-languages = set(concat(languages))
-print(languages)
-decades = {f"{d[:3]}0" for d in ds["date"]}
-multi_language_ds = ds.filter(
-    lambda x: x["multi_language"] is True and x["language"] is not None
-)
-single_language_ds = ds.filter(
-    lambda x: x["multi_language"] is False and x["language"] is not None
-)
-no_language_found_ds = ds.filter(lambda x: x["language"] is None)
-for language in tqdm(languages):
-    lang_ds = single_language_ds.filter(lambda x: language in x["language"])
-    for decade in tqdm(decades, leave=False):
-        decade_ds = lang_ds.filter(
-            lambda x: f"{x['date'].split('-')[0][:3]}0" == decade
-        )
-        if len(decade_ds) > 0:
-            decade_ds.to_parquet(f"{language}-{decade}.parquet")
-for decade in tqdm(decades, leave=False):
-    decade_ds = multi_language_ds.filter(
-        lambda x: f"{x['date'].split('-')[0][:3]}0" == decade
-    )
-    if len(decade_ds) > 0:
-        decade_ds.to_parquet(f"multi_language-{decade}.parquet")
-for decade in tqdm(decades, leave=False):
-    decade_ds = no_language_found_ds.filter(
-        lambda x: f"{x['date'].split('-')[0][:3]}0" == decade
-    )
-    if len(decade_ds) > 0:
-        decade_ds.to_parquet(f"no_language_found-{decade}.parquet")
+partitions = write_partitioned_parquet(ds.data.to_batches(), "partitioned")
+print(sorted(partitions))